@@ -12,9 +12,16 @@ from controller.usuarios_controller import usuarios_bp
 from controller.especialidades_controller import especialidades_bp
 from controller.niveis_controller import niveis_bp
 from controller.cliente_controller import cliente_bp
+from model.auth import verify_token
+from model.login import host_do_tenant, resolver_tenant
+from model.migracoes import tenant_em_dia
+from model.json_rapido import JSONProviderRapido
 
 app = Flask(__name__)
 
+# JSON das respostas via orjson (fallback para o json padrão se não estiver instalado)
+app.json = JSONProviderRapido(app)
+
 # CORS simples (sem JWT)
 CORS(app)
 
@@ -50,6 +57,31 @@ _PUBLIC_PREFIXES = [
 ]
 
 
+def _tenant_do_token(payload):
+    # O token assina o tenant (domínio cadastrado), nunca o IP; o host vem do
+    # diretório em memória, sem consultar o banco central a cada requisição.
+    # Tokens anteriores só trazem o domínio digitado no login
+    dominio = payload.get('dominio')
+    host = host_do_tenant(payload.get('tenant') or dominio)
+    return {'dominio': dominio, 'host': host} if host else None
+
+
+def _tenant_desatualizado(host):
+    # Tenant com migração pendente (ou que falhou na release) fica fora do ar
+    # sozinho; os demais seguem atendidos
+    if tenant_em_dia(host):
+        return None
+    return jsonify({ 'success': False, 'message': 'Domínio em atualização, tente novamente em instantes' }), 503
+
+
+def _dominio_publico():
+    # Rotas públicas recebem o domínio na query string ou no corpo JSON
+    dominio = request.args.get('dominio')
+    if not dominio:
+        dominio = (request.get_json(silent=True) or {}).get('dominio')
+    return dominio if isinstance(dominio, str) else None
+
+
 @app.before_request
 def _require_authentication():
     try:
@@ -59,7 +91,8 @@ def _require_authentication():
 
         path = request.path or '/'
         if any(path.startswith(prefix) for prefix in _PUBLIC_PREFIXES):
-            return None
+            dominio = _dominio_publico()
+            return _tenant_desatualizado(resolver_tenant(dominio)[1]) if dominio else None
 
         # Aceitar Authorization: Bearer <token> ou X-Auth-Token
         auth_header = request.headers.get('Authorization', '')
@@ -72,15 +105,18 @@ def _require_authentication():
         if not token:
             return jsonify({ 'success': False, 'message': 'Não autorizado' }), 401
 
-        # Validar token
-        from model.auth import verify_token
+        # Validar token (tokens recentes saem do cache em memória de model.auth)
         ok, payload, err = verify_token(token)
         if not ok:
             return jsonify({ 'success': False, 'message': err or 'Token inválido' }), 401
 
-        # Disponibiliza o usuário para handlers
+        # Disponibiliza o usuário e o tenant (usado por busca_ip nos models) para handlers
         g.current_user = payload
-        return None
+        g.tenant = _tenant_do_token(payload)
+        if g.tenant is None:
+            # Sem host para o domínio do token, não cair no `dominio` enviado pelo cliente
+            return jsonify({ 'success': False, 'message': 'Domínio do usuário indisponível' }), 503
+        return _tenant_desatualizado(g.tenant['host'])
     except Exception:
         # Em caso de falha inesperada, negar acesso sem vazar detalhes
         return jsonify({ 'success': False, 'message': 'Não autorizado' }), 401
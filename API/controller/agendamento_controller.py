@@ -1,9 +1,15 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, g, request, jsonify
+import os
 import model.agendamento as agendamento_mod
+from model.auth import criar_ticket_eventos
 
 
 agendamento_bp = Blueprint("agendamento", __name__)
 
+# URL pública do serviço de eventos (python -m model.eventos_agenda); vazia desativa
+# o push e os navegadores ficam só na consulta periódica de /agendamentos/changes
+SSE_URL = os.getenv("SSE_URL", "http://localhost:5001/eventos")
+
 
 @agendamento_bp.route("/agendamentos", methods=["GET"])
 def listar_agendamentos():
@@ -13,11 +19,76 @@ def listar_agendamentos():
     func = getattr(agendamento_mod, "listar_agendamentos", None)
     if not callable(func):
         return jsonify({"success": False, "message": "Função listar_agendamentos não encontrada"}), 500
-    result = func(dominio)
+    result = func(
+        dominio,
+        de=request.args.get("de"),
+        ate=request.args.get("ate"),
+        id_especialista=request.args.get("id_especialista", type=int),
+        id_cliente=request.args.get("id_cliente", type=int),
+        limite=request.args.get("limite", type=int),
+        cursor=request.args.get("cursor"),
+    )
+    status_code = 200 if result.get("success") else 400
+    return jsonify(result), status_code
+
+
+@agendamento_bp.route("/agendamentos/export", methods=["GET"])
+def exportar_agendamentos():
+    dominio = request.args.get("dominio")
+    if not dominio:
+        return jsonify({"success": False, "message": "Informe o dominio"}), 400
+    formato = (request.args.get("formato") or "ndjson").lower()
+    result = agendamento_mod.exportar_agendamentos(
+        dominio,
+        formato=formato,
+        de=request.args.get("de"),
+        ate=request.args.get("ate"),
+        id_especialista=request.args.get("id_especialista", type=int),
+        id_cliente=request.args.get("id_cliente", type=int),
+    )
+    if not result.get("success"):
+        return jsonify(result), 400
+    # Corpo gerado sob demanda: cada linha vai para o cliente assim que é lida do banco
+    return Response(
+        result["linhas"],
+        mimetype=result["mimetype"],
+        headers={"Content-Disposition": f"attachment; filename=agendamentos.{formato}"},
+    )
+
+
+@agendamento_bp.route("/agendamentos/resumo", methods=["GET"])
+def resumo_agendamentos():
+    dominio = request.args.get("dominio")
+    if not dominio:
+        return jsonify({"success": False, "message": "Informe o dominio"}), 400
+    result = agendamento_mod.resumo_agendamentos(
+        dominio,
+        hoje=request.args.get("hoje"),
+        agora=request.args.get("agora"),
+    )
     status_code = 200 if result.get("success") else 400
     return jsonify(result), status_code
 
 
+@agendamento_bp.route("/agendamentos/changes", methods=["GET"])
+def alteracoes_agendamentos():
+    dominio = request.args.get("dominio")
+    if not dominio:
+        return jsonify({"success": False, "message": "Informe o dominio"}), 400
+    result = agendamento_mod.alteracoes_agendamentos(dominio, since=request.args.get("since"))
+    return jsonify(result), (200 if result.get("success") else 400)
+
+
+@agendamento_bp.route("/agendamentos/eventos/ticket", methods=["POST"])
+def ticket_eventos():
+    if not SSE_URL:
+        return jsonify({"success": False, "message": "Eventos da agenda desativados"}), 404
+    # O ticket leva o tenant do token (não o IP nem o domínio enviado pelo cliente)
+    usuario = g.current_user or {}
+    tenant = usuario.get("tenant") or usuario.get("dominio")
+    return jsonify({"success": True, "ticket": criar_ticket_eventos(tenant), "url": SSE_URL}), 200
+
+
 @agendamento_bp.route("/agendamentos", methods=["POST"])
 @agendamento_bp.route("/agendamento", methods=["POST"])  # alias singular
 def criar_agendamento():
@@ -44,7 +44,7 @@ def atualizar_conta():
     if not user_id:
         return jsonify({"success": False, "message": "Informe id_usuario"}), 400
 
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info["success"]:
@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from model import especialistas as especialistas_model
+from model import agendamento as agendamento_model
 
 
 especialistas_bp = Blueprint("especialistas", __name__)
@@ -52,6 +53,18 @@ def atualizar_especialista(id_especialista):
     return jsonify(result), status
 
 
+@especialistas_bp.route("/especialistas/<int:id_especialista>/disponibilidade", methods=["GET"])
+def disponibilidade_especialista(id_especialista):
+    dominio = request.args.get("dominio")
+    de = request.args.get("de")
+    ate = request.args.get("ate") or de
+    if not dominio or not de:
+        return jsonify({"success": False, "message": "Informe dominio e de (ate opcional)"}), 400
+    result = agendamento_model.disponibilidade_especialista(dominio, id_especialista, de, ate)
+    status = 200 if result.get("success") else 400
+    return jsonify(result), status
+
+
 @especialistas_bp.route("/especialistas/<int:id_especialista>/especialidades", methods=["GET"])
 def listar_especialidades_de_um(id_especialista):
     dominio = request.args.get("dominio")
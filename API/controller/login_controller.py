@@ -1,23 +1,66 @@
 from flask import Blueprint, request, jsonify, current_app
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 from model.login import busca_ip
 from model.db_config import conexao
 from model.criptografia import camuflar_senha
-from datetime import datetime, timedelta
+from model.codigos_reset import CODIGOS_RESET_TTL, criar_armazem
+from model.caixa_saida import config_smtp, enfileirar
+from datetime import datetime
+from string import Template
 import random
+import time
 
-# Armazenamento simples em memória para códigos de recuperação
-# Chave: f"{dominio}|{email}" -> { 'code': '123456', 'expires_at': datetime }
-_reset_codes = {}
+# Códigos de recuperação, compartilhados entre workers (ver model.codigos_reset)
+# Chave: f"{dominio}|{email}" -> { 'code': '123456', 'expires_at': epoch }
+_reset_codes = criar_armazem()
 from model.login import login as login_service
 from model.auth import create_token, verify_token as verify_token_util
 
 
 login_bp = Blueprint("login", __name__)
 
+# Modelos do e-mail de recuperação, compilados uma vez (HTML estilizado com fallback em texto simples)
+_HTML_RESET = Template("""
+<div style="background:#0f172a;padding:24px 0">
+  <table role="presentation" width="100%" cellspacing="0" cellpadding="0" style="max-width:640px;margin:0 auto;background:#ffffff;border-radius:12px;overflow:hidden;border:1px solid #e5e7eb">
+    <tr>
+      <td style="background:#0f172a;color:#ffffff;padding:18px 24px;font-family:Segoe UI,Arial,sans-serif;">
+        <div style="font-weight:800;font-style:italic;font-size:22px;letter-spacing:.5px">DUALM</div>
+      </td>
+    </tr>
+    <tr>
+      <td style="padding:24px 24px 8px 24px;font-family:Segoe UI,Arial,sans-serif;color:#111827">
+        <div style="font-size:18px;font-weight:700;margin-bottom:6px">Recuperação de senha</div>
+        <div style="font-size:14px;color:#374151">Recebemos uma solicitação para redefinir sua senha. Se você não solicitou, ignore este e-mail.</div>
+      </td>
+    </tr>
+    <tr>
+      <td style="padding:8px 24px 24px 24px;font-family:Segoe UI,Arial,sans-serif">
+        <div style="background:#f3f4f6;border:1px solid #e5e7eb;border-radius:10px;padding:16px;text-align:center">
+          <div style="font-size:13px;color:#6b7280;margin-bottom:6px">Seu código de verificação</div>
+          <div style="font-size:28px;font-weight:800;letter-spacing:6px;color:#111827">$codigo</div>
+          <div style="font-size:12px;color:#6b7280;margin-top:8px">Válido por $validade_min minutos</div>
+        </div>
+        <div style="font-size:12px;color:#6b7280;margin-top:16px">Use este código na tela de login do sistema para criar uma nova senha.</div>
+      </td>
+    </tr>
+    <tr>
+      <td style="background:#f9fafb;color:#6b7280;padding:16px 24px;font-size:12px;font-family:Segoe UI,Arial,sans-serif">
+        © $ano Dualm. Todos os direitos reservados.
+      </td>
+    </tr>
+  </table>
+</div>
+""")
+
+_TEXTO_RESET = Template(
+    "Recuperação de senha - Dualm\n\n"
+    "Seu código: $codigo\nVálido por $validade_min minutos.\n\n"
+    "Use este código na tela de login para criar uma nova senha."
+)
+
 
 @login_bp.route("/login", methods=["POST"])
 def login_route():
@@ -34,16 +77,20 @@ def login_route():
         }), 400
 
     result = login_service(dominio, email, senha)
+    if result.get('code') == 'LOGIN_OCUPADO':
+        return jsonify(result), 503, {'Retry-After': '1'}
     if not result.get('success'):
         return jsonify(result), 401
 
     usuario = result.get('usuario') or {}
-    # Monta payload mínimo no token
+    # Monta payload mínimo no token. `tenant` (domínio cadastrado, não o IP) é
+    # resolvido nas requisições pelo diretório em memória de model.login
     payload = {
         'dominio': dominio,
+        'tenant': result.pop('tenant', None),
         'user_id': usuario.get('id_usuario') or usuario.get('id') or usuario.get('idusuario'),
         'email': usuario.get('email'),
-        'nome': usuario.get('nome_usuario') or usuario.get('nome')
+        'nome': usuario.get('nome_usuario') or usuario.get('nome'),
     }
     token = create_token(payload)
     result['token'] = token
@@ -67,73 +114,27 @@ def esqueci_senha_route():
             "message": "Campos obrigatórios ausentes: dominio, email"
         }), 400
 
-    # Gerar código de 6 dígitos com expiração de 15 minutos
+    # Gerar código de 6 dígitos com expiração de CODIGOS_RESET_TTL
     try:
         code = str(random.randint(100000, 999999))
         key = f"{dominio}|{email}"
-        _reset_codes[key] = {
-            'code': code,
-            'expires_at': datetime.utcnow() + timedelta(minutes=15)
-        }
-
-        subject = "Recuperação de senha • Dualm"
-
-        # HTML estilizado (com fallback em texto simples)
-        html = f"""
-        <div style=\"background:#0f172a;padding:24px 0\">
-          <table role=\"presentation\" width=\"100%\" cellspacing=\"0\" cellpadding=\"0\" style=\"max-width:640px;margin:0 auto;background:#ffffff;border-radius:12px;overflow:hidden;border:1px solid #e5e7eb\">
-            <tr>
-              <td style=\"background:#0f172a;color:#ffffff;padding:18px 24px;font-family:Segoe UI,Arial,sans-serif;\">
-                <div style=\"font-weight:800;font-style:italic;font-size:22px;letter-spacing:.5px\">DUALM</div>
-              </td>
-            </tr>
-            <tr>
-              <td style=\"padding:24px 24px 8px 24px;font-family:Segoe UI,Arial,sans-serif;color:#111827\">
-                <div style=\"font-size:18px;font-weight:700;margin-bottom:6px\">Recuperação de senha</div>
-                <div style=\"font-size:14px;color:#374151\">Recebemos uma solicitação para redefinir sua senha. Se você não solicitou, ignore este e-mail.</div>
-              </td>
-            </tr>
-            <tr>
-              <td style=\"padding:8px 24px 24px 24px;font-family:Segoe UI,Arial,sans-serif\">
-                <div style=\"background:#f3f4f6;border:1px solid #e5e7eb;border-radius:10px;padding:16px;text-align:center\">
-                  <div style=\"font-size:13px;color:#6b7280;margin-bottom:6px\">Seu código de verificação</div>
-                  <div style=\"font-size:28px;font-weight:800;letter-spacing:6px;color:#111827\">{code}</div>
-                  <div style=\"font-size:12px;color:#6b7280;margin-top:8px\">Válido por 15 minutos</div>
-                </div>
-                <div style=\"font-size:12px;color:#6b7280;margin-top:16px\">Use este código na tela de login do sistema para criar uma nova senha.</div>
-              </td>
-            </tr>
-            <tr>
-              <td style=\"background:#f9fafb;color:#6b7280;padding:16px 24px;font-size:12px;font-family:Segoe UI,Arial,sans-serif\">
-                © {datetime.utcnow().year} Dualm. Todos os direitos reservados.
-              </td>
-            </tr>
-          </table>
-        </div>
-        """
-
-        text_fallback = (
-            "Recuperação de senha - Dualm\n\n"
-            "Seu código: " + code + "\nVálido por 15 minutos.\n\n"
-            "Use este código na tela de login para criar uma nova senha."
-        )
+        _reset_codes.salvar(key, code)
+        validade_min = CODIGOS_RESET_TTL // 60
+        valores = {'codigo': code, 'validade_min': validade_min, 'ano': datetime.utcnow().year}
 
         msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
+        msg['Subject'] = "Recuperação de senha • Dualm"
         msg['From'] = current_app.config.get('MAIL_DEFAULT_SENDER')
         msg['To'] = email
-        msg.attach(MIMEText(text_fallback, 'plain', 'utf-8'))
-        msg.attach(MIMEText(html, 'html', 'utf-8'))
-
-        server = smtplib.SMTP(current_app.config.get('MAIL_SERVER'), current_app.config.get('MAIL_PORT'))
-        if current_app.config.get('MAIL_USE_TLS'):
-            server.starttls()
-        server.login(current_app.config.get('MAIL_USERNAME'), current_app.config.get('MAIL_PASSWORD'))
-        server.sendmail(msg['From'], [email], msg.as_string())
-        server.quit()
+        msg.attach(MIMEText(_TEXTO_RESET.substitute(valores), 'plain', 'utf-8'))
+        msg.attach(MIMEText(_HTML_RESET.substitute(valores), 'html', 'utf-8'))
+
+        # Envio fica com a caixa de saída (model.caixa_saida); a resposta não espera o SMTP
+        if not enfileirar(config_smtp(current_app.config), msg, [email]):
+            print("Caixa de saída cheia: e-mail de recuperação descartado")
     except Exception as e:
         # Não revelar detalhes ao usuário
-        print(f"Erro ao enviar e-mail de recuperação: {e}")
+        print(f"Erro ao preparar e-mail de recuperação: {e}")
 
     # Mensagem genérica de sucesso (mesmo em caso de falha de envio, por segurança)
     return jsonify({
@@ -189,11 +190,11 @@ def redefinir_senha_codigo_route():
         return jsonify({ 'success': False, 'message': 'Informe domínio, e-mail, código e nova senha' }), 400
 
     key = f"{dominio}|{email}"
-    info = _reset_codes.get(key)
+    info = _reset_codes.obter(key)
     if not info:
         return jsonify({ 'success': False, 'message': 'Solicite um novo código' }), 400
-    if datetime.utcnow() > info['expires_at']:
-        _reset_codes.pop(key, None)
+    if time.time() > info['expires_at']:
+        _reset_codes.remover(key)
         return jsonify({ 'success': False, 'message': 'Código expirado' }), 400
     if str(codigo) != str(info['code']):
         return jsonify({ 'success': False, 'message': 'Código inválido' }), 400
@@ -209,7 +210,7 @@ def redefinir_senha_codigo_route():
         with conn.cursor() as cur:
             cur.execute("UPDATE usuarios SET senha = %s WHERE email = %s", (camuflar_senha(nova_senha), email))
             conn.commit()
-        _reset_codes.pop(key, None)
+        _reset_codes.remover(key)
         return jsonify({ 'success': True, 'message': 'Senha redefinida com sucesso' }), 200
     except Exception as e:
         print(f"Erro ao redefinir senha por código: {e}")
@@ -45,57 +45,88 @@ def n8n_criar_agendamento():
     if missing:
         return jsonify({ 'success': False, 'message': f"Campos obrigatórios ausentes: {', '.join(missing)}" }), 400
 
-    # Enforce regras como no site (sem ignorar limite por padrão)
-    result = ag_mod.agendamento(id_cliente, id_especialista, data_ag, horario, dominio, ignorar_limite=False)
+    # Enforce regras como no site (sem ignorar limite por padrão). Na falha, o
+    # resultado já traz as regras lidas na validação, usadas nas sugestões
+    result = ag_mod.agendamento(id_cliente, id_especialista, data_ag, horario, dominio,
+                                ignorar_limite=False, com_regras=True)
     if result.get('success'):
         return jsonify(result), 201
 
+    regras = result.pop('regras', None)
     # Quando falha, tentar sugerir até 3 horários/dias alternativos
-    try:
-        cliente_tem_conv, id_conv = ag_mod.info_cliente(id_cliente, dominio)
-        especialista, convenios_especialista, tempo_consulta = ag_mod.info_especialista(id_especialista, dominio)
-        max_consulta, antecedencia = (0, 0)
-        aceita_convenio = False
-        if cliente_tem_conv and convenios_especialista:
-            try:
-                aceita_convenio = any((row.get('id_convenio') == id_conv) for row in convenios_especialista)
-            except Exception:
-                aceita_convenio = False
-        if cliente_tem_conv and aceita_convenio:
-            try:
-                max_consulta, antecedencia = ag_mod.info_gerencia_agenda(id_especialista, id_conv, dominio)
-            except Exception:
-                max_consulta, antecedencia = 0, 0
-
-        sugestoes = []
+    sugestoes = result.get('sugestoes')
+    if sugestoes is None and regras:
         try:
             sugestoes = ag_mod.sugerir_horarios_ia(
                 id_especialista=id_especialista,
-                id_convenio=id_conv,
+                id_convenio=regras['id_convenio'],
                 data_str=data_ag,
                 horario_str=horario,
                 dominio=dominio,
-                antecedencia_dias=antecedencia or 0,
-                max_consulta=max_consulta or 0,
-                tempo_consulta_min=tempo_consulta or 0,
+                antecedencia_dias=regras['antecedencia'] or 0,
+                max_consulta=regras['max_consulta'] or 0,
+                tempo_consulta_min=regras['tempo_consulta'] or 0,
                 k=3
             )
         except Exception:
             sugestoes = []
-
-        payload_fail = {
-            'success': False,
-            'message': result.get('message') or 'Não foi possível criar o agendamento',
-            'code': result.get('code') or 'AGENDAMENTO_FALHOU',
-            'sugestoes': sugestoes
-        }
-        # 409 sinaliza conflito/regra de negócio
-        return jsonify(payload_fail), 409
-    except Exception:
-        # Se algo der errado ao sugerir, apenas devolve o erro original
+    if sugestoes is None:
+        # Falhou antes de ler os dados (data/horário inválidos, erro de conexão): sem sugestões
         status = 409 if result.get('code') else 400
         return jsonify(result), status
 
+    payload_fail = {
+        'success': False,
+        'message': result.get('message') or 'Não foi possível criar o agendamento',
+        'code': result.get('code') or 'AGENDAMENTO_FALHOU',
+        'sugestoes': sugestoes
+    }
+    # 409 sinaliza conflito/regra de negócio
+    return jsonify(payload_fail), 409
+
+
+@n8n_bp.route('/n8n/especialistas/<int:id_especialista>/disponibilidade', methods=['GET'])
+def n8n_disponibilidade_especialista(id_especialista):
+    # Basic Auth
+    if not _check_basic_auth(request):
+        resp = jsonify({ 'success': False, 'message': 'Não autorizado' })
+        resp.status_code = 401
+        resp.headers['WWW-Authenticate'] = 'Basic realm="n8n"'
+        return resp
+
+    dominio = request.args.get('dominio')
+    de = request.args.get('de')
+    ate = request.args.get('ate') or de
+    if not dominio or not de:
+        return jsonify({ 'success': False, 'message': 'Informe dominio e de (ate opcional)' }), 400
+
+    result = ag_mod.disponibilidade_especialista(dominio, id_especialista, de, ate)
+    return jsonify(result), (200 if result.get('success') else 400)
+
+
+@n8n_bp.route('/n8n/horarios-livres', methods=['GET'])
+def n8n_horarios_livres():
+    """Primeiros horários livres entre os especialistas de uma especialidade (opcionalmente por convênio)."""
+    # Basic Auth
+    if not _check_basic_auth(request):
+        resp = jsonify({ 'success': False, 'message': 'Não autorizado' })
+        resp.status_code = 401
+        resp.headers['WWW-Authenticate'] = 'Basic realm="n8n"'
+        return resp
+
+    dominio = request.args.get('dominio')
+    id_especialidade = request.args.get('id_especialidade', type=int)
+    id_convenio = request.args.get('id_convenio', type=int)
+    de = request.args.get('de')
+    ate = request.args.get('ate') or de
+    horario = request.args.get('horario')
+    k = min(max(request.args.get('k', default=5, type=int), 1), 50)
+    if not dominio or id_especialidade is None or not de:
+        return jsonify({ 'success': False, 'message': 'Informe dominio, id_especialidade e de (ate, id_convenio, horario e k opcionais)' }), 400
+
+    result = ag_mod.horarios_livres_por_especialidade(dominio, id_especialidade, id_convenio, de, ate, horario=horario, k=k)
+    return jsonify(result), (200 if result.get('success') else 400)
+
 
 @n8n_bp.route('/n8n/agendamentos/sem-convenio', methods=['POST'])
 def n8n_criar_agendamento_sem_convenio():
@@ -121,31 +152,35 @@ def n8n_criar_agendamento_sem_convenio():
     # Força fluxo sem convênio: ignora limites por convênio.
     # Se o cliente tiver convênio, vamos agendar como sem convênio (id_convenio=None) usando rotina principal.
     try:
-        # Precisamos do tempo_consulta e outras regras (disponibilidade/antecedência de atendimento do especialista ainda valem)
-        especialista, _convs, tempo_consulta = ag_mod.info_especialista(id_especialista, dominio)
-        # Checa regras de disponibilidade comuns
-        if not ag_mod.medico_atende_no_horario(id_especialista, data_ag, horario, tempo_consulta, dominio):
-            return jsonify({ 'success': False, 'message': 'Especialista não atende neste dia/horário' }), 409
-        if not ag_mod.horario_cliente_disponivel(id_cliente, data_ag, horario, tempo_consulta, dominio):
-            return jsonify({ 'success': False, 'message': 'Cliente já possui agendamento neste horário' }), 409
-        if not ag_mod.horario_disponivel(id_especialista, data_ag, horario, tempo_consulta, dominio):
-            # Sem convênio: se o horário já está ocupado, sugerimos alternativas
-            sugestoes = ag_mod.sugerir_horarios_ia(
-                id_especialista=id_especialista,
-                id_convenio=None,
-                data_str=data_ag,
-                horario_str=horario,
-                dominio=dominio,
-                antecedencia_dias=0,
-                max_consulta=0,
-                tempo_consulta_min=tempo_consulta or 0,
-                k=3
-            )
-            return jsonify({ 'success': False, 'code': 'HORARIO_OCUPADO', 'message': 'Horário já ocupado para este especialista', 'sugestoes': sugestoes }), 409
-
-        # Tudo certo: realiza sem convênio (id_convenio=None)
-        ag_mod.realiza_agendamento(id_cliente, id_especialista, data_ag, horario, tempo_consulta, None, dominio)
-        return jsonify({ 'success': True, 'message': 'Agendamento realizado com sucesso (sem convênio)' }), 201
+        # Checagens e gravação numa única conexão/transação do tenant
+        with ag_mod.transacao_dominio(dominio):
+            # Precisamos do tempo_consulta e outras regras (disponibilidade/antecedência de atendimento do especialista ainda valem)
+            especialista, _convs, tempo_consulta = ag_mod.info_especialista(id_especialista, dominio)
+            # Checa regras de disponibilidade comuns
+            if not ag_mod.medico_atende_no_horario(id_especialista, data_ag, horario, tempo_consulta, dominio):
+                return jsonify({ 'success': False, 'message': 'Especialista não atende neste dia/horário' }), 409
+            if not ag_mod.horario_cliente_disponivel(id_cliente, data_ag, horario, tempo_consulta, dominio):
+                return jsonify({ 'success': False, 'message': 'Cliente já possui agendamento neste horário' }), 409
+            if not ag_mod.horario_disponivel(id_especialista, data_ag, horario, tempo_consulta, dominio):
+                # Sem convênio: se o horário já está ocupado, sugerimos alternativas
+                sugestoes = ag_mod.sugerir_horarios_ia(
+                    id_especialista=id_especialista,
+                    id_convenio=None,
+                    data_str=data_ag,
+                    horario_str=horario,
+                    dominio=dominio,
+                    antecedencia_dias=0,
+                    max_consulta=0,
+                    tempo_consulta_min=tempo_consulta or 0,
+                    k=3
+                )
+                return jsonify({ 'success': False, 'code': 'HORARIO_OCUPADO', 'message': 'Horário já ocupado para este especialista', 'sugestoes': sugestoes }), 409
+
+            # Tudo certo: realiza sem convênio (id_convenio=None)
+            gravado = ag_mod.realiza_agendamento(id_cliente, id_especialista, data_ag, horario, tempo_consulta, None, dominio)
+            if not gravado.get('success'):
+                return jsonify({ 'success': False, 'code': gravado.get('code'), 'message': gravado.get('message') }), 409
+            return jsonify({ 'success': True, 'message': 'Agendamento realizado com sucesso (sem convênio)' }), 201
     except Exception as e:
         # Tentativa de sugestões em caso de erro inesperado
         try:
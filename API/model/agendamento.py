@@ -1,24 +1,89 @@
-from model.db_config import conexao
+from model.db_config import conexao, transacao_requisicao
 from model.login import busca_ip
+from model.grade_horaria import obter_grade, registrar_grade
+from model import json_rapido
+from model.schema import dialeto
 from datetime import datetime
-import json
+import base64
+import csv
+import io
+import os
+import threading
+import time as _relogio
+import psycopg2
 
-def agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_limite=False):
 
-    # Lê informações do cliente e especialista
-    cliente_tem_convenio, id_convenio_cliente = info_cliente(id_cliente, dominio)
-    especialista, convenios_especialista, tempo_consulta = info_especialista(id_especialista, dominio)
+def _alvo(dominio):
+    ip = busca_ip(dominio)
+    return ip or dominio
+
+
+def transacao_dominio(dominio):
+    """Transação do tenant compartilhada por todos os helpers chamados dentro do bloco."""
+    return transacao_requisicao(_alvo(dominio))
+
+
+def agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_limite=False, com_regras=False):
+    """
+    Valida e grava o agendamento. Com `com_regras`, uma falha ocorrida depois da
+    leitura dos dados traz também "regras" (id_convenio, tempo_consulta,
+    max_consulta, antecedencia), os parâmetros de sugerir_horarios_ia, para quem
+    sugere alternativas não reler cliente, especialista e gerência.
+    """
+    regras = {}
+    # Todas as leituras e a gravação compartilham uma conexão e um único commit
+    try:
+        with transacao_dominio(dominio):
+            resultado = _agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_limite, regras)
+    except psycopg2.Error as e:
+        resultado = {"success": False, "message": f"Erro ao realizar agendamento: {e}"}
+    if com_regras and regras and not resultado.get("success"):
+        resultado["regras"] = regras
+    return resultado
+
+
+def _agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_limite=False, regras=None):
 
-    # Trava: não permitir agendar em datas passadas
     try:
-        if dif_datas(data) < 0:
-            return {"success": False, "message": "Não é permitido agendar em datas passadas"}
+        dif_data = dif_datas(data)
     except Exception:
         # Em caso de data inválida, falhar também
         return {"success": False, "message": "Data inválida para agendamento"}
 
+    inicio = _parse_horario(horario)
+    if inicio is None:
+        return {"success": False, "message": "Horário inválido para agendamento"}
+
+    # Lê de uma vez tudo o que as regras abaixo precisam (cliente, especialista,
+    # convênios, gerência, conflitos e contagem do dia) e avalia em memória
+    conn_info = conexao(_alvo(dominio))
+    if not conn_info["success"]:
+        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
+    conn = conn_info["connection"]
+    dados = _dados_validacao(conn, id_cliente, id_especialista, data, inicio, dominio)
+    tempo_consulta = dados["tempo_consulta"]
+    cliente_tem_convenio = dados["cliente_tem_convenio"]
+    id_convenio_cliente = dados["id_convenio_cliente"]
+    convenios_especialista = dados["convenios_especialista"] or []
+    aceita_convenio = bool(cliente_tem_convenio) and id_convenio_cliente in convenios_especialista
+    if regras is not None:
+        # Limites da gerência só valem quando o especialista aceita o convênio do cliente
+        regras.update({
+            "id_convenio": id_convenio_cliente,
+            "tempo_consulta": tempo_consulta,
+            "max_consulta": dados["max_consulta"] if aceita_convenio else 0,
+            "antecedencia": dados["antecedencia"] if aceita_convenio else 0,
+        })
+
+    # Trava: não permitir agendar em datas passadas
+    if dif_data < 0:
+        return {"success": False, "message": "Não é permitido agendar em datas passadas"}
+
     # Regra: só permitir agendamento em dias/horários de atendimento do especialista
-    if not medico_atende_no_horario(id_especialista, data, horario, tempo_consulta, dominio):
+    data_dt = datetime.strptime(data, "%Y-%m-%d")
+    # Na gravação a grade é conferida contra o horario_atendimento lido agora, nunca só o cache
+    grade = registrar_grade(getattr(conn, "host", None), id_especialista, dados["horario_atendimento"])
+    if not grade.atende(data_dt, inicio, tempo_consulta):
         return {
             "success": False,
             "message": "Especialista não atende neste dia/horário"
@@ -26,13 +91,13 @@ def agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_lim
 
     # Primeiro, evita conflito para o mesmo cliente no mesmo dia/horário
     # (mesmo que seja outro médico)
-    if not horario_cliente_disponivel(id_cliente, data, horario, tempo_consulta, dominio):
+    if dados["conflito_cliente"]:
         return {
             "success": False,
             "message": "Cliente já possui agendamento neste horário"
         }
     # Em seguida, evita conflito do mesmo especialista no mesmo horário
-    if not horario_disponivel(id_especialista, data, horario, tempo_consulta, dominio):
+    if dados["conflito_especialista"]:
         return {
             "success": False,
             "message": "Horário já ocupado para este especialista"
@@ -40,19 +105,10 @@ def agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_lim
 
     # Se o cliente possui convênio e o especialista aceita este convênio,
     # aplicamos as regras de gerência (máximo por dia/antecedência)
-    aceita_convenio = False
-    if cliente_tem_convenio and convenios_especialista:
-        try:
-            aceita_convenio = any(
-                (row.get("id_convenio") == id_convenio_cliente) for row in convenios_especialista
-            )
-        except Exception:
-            aceita_convenio = False
-
     if cliente_tem_convenio and aceita_convenio:
-        max_consulta, antecedencia = info_gerencia_agenda(id_especialista, id_convenio_cliente, dominio)
-        qtd_agenda = info_agenda(id_especialista, id_convenio_cliente, data, dominio)
-        dif_data = dif_datas(data)
+        max_consulta = dados["max_consulta"]
+        antecedencia = dados["antecedencia"]
+        qtd_agenda = dados["qtd_convenio_dia"]
 
         # Verifica antecedência mínima (não pode ser ignorada por padrão)
         if dif_data < antecedencia:
@@ -77,7 +133,9 @@ def agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_lim
         # Limite por convênio atingido
         if max_consulta and qtd_agenda >= max_consulta:
             if ignorar_limite:
-                realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio_cliente, dominio)
+                gravado = realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio_cliente, dominio)
+                if not gravado.get("success"):
+                    return gravado
                 return {"success": True, "message": "Agendamento realizado (limite por convênio excedido)", "warning": "Limite excedido"}
             else:
                 return {
@@ -89,59 +147,113 @@ def agendamento(id_cliente, id_especialista, data, horario, dominio, ignorar_lim
                     "qtd_atual": int(qtd_agenda)
                 }
 
-        # Caso dentro das regras, realiza normalmente
-        realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio_cliente, dominio)
+        # Caso dentro das regras, realiza normalmente (o limite é conferido de novo na gravação)
+        gravado = realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio_cliente, dominio,
+                                      max_consulta=max_consulta)
+        if not gravado.get("success"):
+            return gravado
         return {"success": True, "message": "Agendamento realizado com sucesso"}
 
     # Caso contrário (sem convênio ou convênio não aceito), permite agendar sem convênio
-    realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, None, dominio)
+    gravado = realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, None, dominio)
+    if not gravado.get("success"):
+        return gravado
     return {"success": True, "message": "Agendamento realizado com sucesso (sem convênio)"}
 
 
-def info_cliente(id_cliente, dominio):
-    ip = busca_ip(dominio) if dominio else None
-    alvo = ip or dominio
-    conn_info = conexao(alvo)
-    if not conn_info["success"]:
-        # Mantém contrato: retorna (convenio_bool, id_convenio or None)
-        return False, None
-    
-    cursor = conn_info["connection"].cursor()
-    cliente = None
-    # Tenta variações comuns de tabela/coluna: cliente/clientes e id_cliente/id
-    for tabela in ("cliente", "clientes"):
-        for coluna in ("id_cliente", "id"):
-            try:
-                cursor.execute(f"SELECT convenio, id_convenio FROM {tabela} WHERE {coluna} = %s", (id_cliente,))
-                cliente = cursor.fetchone()
-                if cliente:
-                    break
-            except Exception as _:
-                continue
-        if cliente:
-            break
-
-    if not cliente:
-        return False, None
-
-    convenio = cliente["convenio"]
+_SQL_VALIDACAO = """
+    WITH cli AS (
+        SELECT convenio, id_convenio
+        FROM {tabela_cliente}
+        WHERE {id_cliente} = %(id_cliente)s
+        LIMIT 1
+    ), esp AS (
+        SELECT aceita_convenio, horario_atendimento,
+               NULLIF(tempo_consulta::text, '')::int AS tempo_consulta
+        FROM especialistas
+        WHERE id_especialista = %(id_especialista)s
+    ), ga AS (
+        SELECT max_consulta, antecedencia
+        FROM gerencia_agenda
+        WHERE id_especialista = %(id_especialista)s
+          AND id_convenio = (SELECT id_convenio FROM cli)
+        LIMIT 1
+    )
+    SELECT
+        cli.convenio AS cliente_convenio,
+        cli.id_convenio AS cliente_id_convenio,
+        esp.aceita_convenio,
+        esp.tempo_consulta,
+        esp.horario_atendimento,
+        CASE WHEN esp.aceita_convenio THEN ARRAY(
+            SELECT id_convenio FROM {tabela_especialista_convenios} WHERE id_especialista = %(id_especialista)s
+        ) END AS convenios_especialista,
+        ga.max_consulta,
+        ga.antecedencia,
+        (SELECT c.total FROM agenda_convenio_dia c
+          WHERE c.id_especialista = %(id_especialista)s
+            AND c.id_convenio = cli.id_convenio
+            AND c.data_agendamento = %(data)s::date) AS qtd_convenio_dia,
+        EXISTS (SELECT 1 FROM agendamento a
+                 WHERE a.id_cliente = %(id_cliente)s
+                   AND a.periodo && periodo_agendamento(%(data)s::date, %(horario)s::time, esp.tempo_consulta)
+        ) AS conflito_cliente,
+        EXISTS (SELECT 1 FROM agendamento a
+                 WHERE a.id_especialista = %(id_especialista)s
+                   AND a.periodo && periodo_agendamento(%(data)s::date, %(horario)s::time, esp.tempo_consulta)
+        ) AS conflito_especialista
+    FROM (SELECT 1) base
+    LEFT JOIN cli ON TRUE
+    LEFT JOIN esp ON TRUE
+    LEFT JOIN ga ON TRUE
+"""
+
+
+def _dados_validacao(conn, id_cliente, id_especialista, data, inicio, dominio):
+    """
+    Busca numa única consulta tudo o que a decisão de agendamento precisa.
+    Retorna dict com: cliente_tem_convenio, id_convenio_cliente, tempo_consulta,
+    convenios_especialista (lista de ids ou None),
+    max_consulta, antecedencia, qtd_convenio_dia, conflito_cliente, conflito_especialista.
+    Os nomes de tabela/coluna vêm do dialeto do tenant. Não há leitura
+    alternativa: tenant abaixo do schema atual (model.migracoes) falha com o
+    erro do banco.
+    """
+    params = {
+        "id_cliente": id_cliente,
+        "id_especialista": id_especialista,
+        "data": data,
+        "horario": inicio.strftime("%H:%M"),
+    }
+    with conn.cursor() as cur:
+        cur.execute(_SQL_VALIDACAO.format(**dialeto(conn)._asdict()), params)
+        row = cur.fetchone()
 
-    if convenio == True:
-        id_convenio = cliente["id_convenio"]
-        return convenio, id_convenio
-    else:
-        return convenio, None
+    cliente_tem_convenio = row["cliente_convenio"] == True
+    return {
+        "cliente_tem_convenio": cliente_tem_convenio,
+        "id_convenio_cliente": row["cliente_id_convenio"] if cliente_tem_convenio else None,
+        "tempo_consulta": row["tempo_consulta"],
+        "horario_atendimento": row["horario_atendimento"],
+        "convenios_especialista": row["convenios_especialista"],
+        "max_consulta": int(row["max_consulta"] or 0),
+        "antecedencia": int(row["antecedencia"] or 0),
+        "qtd_convenio_dia": int(row["qtd_convenio_dia"] or 0),
+        "conflito_cliente": bool(row["conflito_cliente"]),
+        "conflito_especialista": bool(row["conflito_especialista"]),
+    }
 
 
 def info_especialista(id_especialista, dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
         # Retorna tupla consistente para evitar exceptions no chamador
         return {}, False, None
     
-    cursor = conn_info["connection"].cursor()
+    conn = conn_info["connection"]
+    cursor = conn.cursor()
     cursor.execute("SELECT aceita_convenio, tempo_consulta FROM especialistas WHERE id_especialista = %s", (id_especialista,))
     especialista = cursor.fetchone()
     if not especialista:
@@ -150,63 +262,15 @@ def info_especialista(id_especialista, dominio):
     tempo_consulta = especialista["tempo_consulta"]
     
     if especialista["aceita_convenio"] == True:
-        convenio = []
-        # Tenta nome no singular e plural
-        for tabela in ("especialista_convenios", "especialistas_convenios"):
-            try:
-                cursor.execute(f"SELECT id_convenio FROM {tabela} WHERE id_especialista = %s", (id_especialista,))
-                convenio = cursor.fetchall()
-                if convenio:
-                    break
-            except Exception as _:
-                continue
-        if convenio is False:
-            convenio = []
+        tabela = dialeto(conn).tabela_especialista_convenios
+        cursor.execute(f"SELECT id_convenio FROM {tabela} WHERE id_especialista = %s", (id_especialista,))
+        convenio = cursor.fetchall()
     else:
         convenio = False
     
     return especialista,convenio,tempo_consulta
 
 
-def info_gerencia_agenda(id_especialista, id_convenio, dominio):
-    ip = busca_ip(dominio) if dominio else None
-    alvo = ip or dominio
-    conn_info = conexao(alvo)
-    if not conn_info["success"]:
-        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
-    
-    cursor = conn_info["connection"].cursor()
-    cursor.execute("SELECT max_consulta, antecedencia FROM gerencia_agenda WHERE id_especialista = %s AND id_convenio = %s", (id_especialista, id_convenio))
-    row = cursor.fetchone()
-
-    if not row:
-        return 0, 0
-
-    try:
-        max_consulta_val = row["max_consulta"] if isinstance(row, dict) else row[0]
-        antecedencia_val = row["antecedencia"] if isinstance(row, dict) else row[1]
-    except Exception:
-        max_consulta_val, antecedencia_val = 0, 0
-
-    max_consulta = int(max_consulta_val or 0)
-    antecedencia = int(antecedencia_val or 0)
-    
-    return max_consulta, antecedencia
-
-def info_agenda(id_especialista, id_convenio, data, dominio):
-    ip = busca_ip(dominio) if dominio else None
-    alvo = ip or dominio
-    conn_info = conexao(alvo)
-    if not conn_info["success"]:
-        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
-    
-    cursor = conn_info["connection"].cursor()
-    cursor.execute("SELECT COUNT(*) AS total FROM agendamento WHERE id_especialista = %s AND id_convenio = %s AND data_agendamento = %s", (id_especialista, id_convenio, data))
-    row = cursor.fetchone()
-    agenda = row["total"] if isinstance(row, dict) else row[0]
-
-    return agenda
-
 def dif_datas(data_agendamento):
     data_agendamento = datetime.strptime(data_agendamento, "%Y-%m-%d")
     data_atual = datetime.now()
@@ -214,84 +278,114 @@ def dif_datas(data_agendamento):
     return dif.days
 
 
-def realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio, dominio):
-    ip = busca_ip(dominio) if dominio else None
+_SQL_INSERE_SEM_CONFLITO = """
+    WITH conflitos AS (
+        SELECT
+            EXISTS (SELECT 1 FROM agendamento a
+                     WHERE a.id_especialista = %(id_especialista)s
+                       AND a.periodo && periodo_agendamento(%(data)s::date, %(horario)s::time, %(duracao)s)
+            ) AS especialista,
+            EXISTS (SELECT 1 FROM agendamento a
+                     WHERE a.id_cliente = %(id_cliente)s
+                       AND a.periodo && periodo_agendamento(%(data)s::date, %(horario)s::time, %(duracao)s)
+            ) AS cliente,
+            COALESCE((SELECT c.total FROM agenda_convenio_dia c
+                       WHERE c.id_especialista = %(id_especialista)s
+                         AND c.id_convenio = %(id_convenio)s
+                         AND c.data_agendamento = %(data)s::date), 0) AS qtd_convenio_dia
+    ), novo AS (
+        INSERT INTO agendamento (id_cliente, id_especialista, data_agendamento, horario, duracao, id_convenio)
+        SELECT %(id_cliente)s, %(id_especialista)s, %(data)s, %(horario)s, %(tempo_consulta)s, %(id_convenio)s
+        FROM conflitos
+        WHERE NOT conflitos.especialista AND NOT conflitos.cliente
+          AND NOT (%(max_consulta)s > 0 AND conflitos.qtd_convenio_dia >= %(max_consulta)s)
+        RETURNING id_agendamento
+    )
+    SELECT conflitos.especialista, conflitos.cliente, conflitos.qtd_convenio_dia,
+           (SELECT id_agendamento FROM novo) AS id_agendamento
+    FROM conflitos
+"""
+
+
+def _travar_periodo(cursor, id_especialista, id_cliente, data, horario, duracao):
+    """
+    Advisory locks da transação para cada dia que o intervalo do agendamento
+    toca, do especialista e do cliente: um atendimento das 23:30 com 60 min trava
+    também o dia seguinte, então disputa a trava com quem começa às 00:00.
+    Dois intervalos que se sobrepõem têm sempre um dia em comum.
+    As chaves usam a data normalizada ("2025-1-5" e "2025-01-05" travam o mesmo dia)
+    e a ordem fixa (especialista, depois cliente; dias em ordem crescente) em
+    todas as gravações evita deadlock.
+    """
+    dia = data if hasattr(data, "isoformat") else datetime.strptime(data, "%Y-%m-%d").date()
+    inicio = horario if hasattr(horario, "hour") else _parse_horario(str(horario))
+    dias = [dia]
+    if inicio is not None and int(duracao or 0) > 0:
+        # Fim exclusivo: terminar exatamente à meia-noite não toca o dia seguinte
+        ultimo = (datetime.combine(dia, inicio) + timedelta(minutes=int(duracao) - 1)).date()
+        while dias[-1] < ultimo:
+            dias.append(dias[-1] + timedelta(days=1))
+    for d in dias:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"agendamento:especialista:{id_especialista}:{d.isoformat()}",))
+    for d in dias:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"agendamento:cliente:{id_cliente}:{d.isoformat()}",))
+
+
+def realiza_agendamento(id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio, dominio, max_consulta=0):
+    """
+    Grava o agendamento de forma atômica: trava os dias do especialista e do
+    cliente que o intervalo toca (advisory locks da transação) e só insere se não houver sobreposição,
+    checada no próprio INSERT. Dois pedidos concorrentes para o mesmo horário
+    nunca geram agendamento duplo; o segundo recebe code HORARIO_OCUPADO.
+    Com max_consulta > 0, o limite diário do convênio é conferido no contador sob
+    a mesma trava (code LIMITE_CONVENIO quando atingido).
+    """
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
         return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
-    
-    cursor = conn_info["connection"].cursor()
-    cursor.execute("INSERT INTO agendamento (id_cliente, id_especialista, data_agendamento, horario, duracao, id_convenio) VALUES (%s, %s, %s, %s, %s, %s)", (id_cliente, id_especialista, data, horario, tempo_consulta, id_convenio))
-    conn_info["connection"].commit()
+
+    conn = conn_info["connection"]
+    cursor = conn.cursor()
+    _travar_periodo(cursor, id_especialista, id_cliente, data, horario, tempo_consulta)
+    cursor.execute(_SQL_INSERE_SEM_CONFLITO, {
+        "id_cliente": id_cliente,
+        "id_especialista": id_especialista,
+        "data": data,
+        "horario": horario,
+        "duracao": int(tempo_consulta or 0),
+        "tempo_consulta": tempo_consulta,
+        "id_convenio": id_convenio,
+        "max_consulta": int(max_consulta or 0),
+    })
+    row = cursor.fetchone()
+    conn.commit()
+
+    if row["id_agendamento"] is None:
+        if row["cliente"]:
+            return {"success": False, "code": "HORARIO_OCUPADO", "message": "Cliente já possui agendamento neste horário"}
+        if row["especialista"]:
+            return {"success": False, "code": "HORARIO_OCUPADO", "message": "Horário já ocupado para este especialista"}
+        return {
+            "success": False,
+            "code": "LIMITE_CONVENIO",
+            "message": "Limite de agendamentos por convênio atingido para este dia. Deseja continuar mesmo assim?",
+            "can_override": True,
+            "limite": int(max_consulta),
+            "qtd_atual": int(row["qtd_convenio_dia"]),
+        }
+    return {"success": True, "id_agendamento": row["id_agendamento"]}
 
 from datetime import datetime, timedelta, time
 
 # --- Helpers para horários de trabalho e grade ---
 def _grade_horaria_especialista(conn, id_especialista, data_referencia=None):
     """
-    Lê a coluna horario_atendimento do especialista e retorna lista de tuplas (inicio, fim) como objetos time.
-    Suporta dois formatos:
-    - Lista simples: [{"inicio":"08:00","fim":"12:00"}, ...]
-    - Mapa por dia: {seg:[{...}], ter:[{...}], ...}
+    Janelas (inicio, fim) de atendimento do especialista no dia de referência, como objetos time.
+    A grade vem compilada do cache de model.grade_horaria.
     """
-    cur = conn.cursor()
-    cur.execute("SELECT horario_atendimento FROM especialistas WHERE id_especialista = %s", (id_especialista,))
-    row = cur.fetchone()
-    cur.close()
-
-    if not row or not row.get("horario_atendimento"):
-        # fallback se não houver nada configurado
-        return [(time(8, 0), time(12, 0)), (time(13, 30), time(17, 30))]
-
-    try:
-        # Converte JSON para Python
-        raw = row.get("horario_atendimento")
-        horarios = json.loads(raw) if isinstance(raw, str) else raw
-
-        # Caso 1: lista simples
-        if isinstance(horarios, list):
-            grade = []
-            for h in horarios:
-                inicio = datetime.strptime(h["inicio"], "%H:%M").time()
-                fim = datetime.strptime(h["fim"], "%H:%M").time()
-                grade.append((inicio, fim))
-            return grade
-
-        # Caso 2: mapa por dia
-        if isinstance(horarios, dict):
-            dia_idx = (data_referencia.weekday() if isinstance(data_referencia, datetime) else datetime.now().weekday())
-            mapa = {
-                0: ["seg", "segunda"],
-                1: ["ter", "terca", "terça"],
-                2: ["qua", "quarta"],
-                3: ["qui", "quinta"],
-                4: ["sex", "sexta"],
-                5: ["sab", "sabado", "sábado"],
-                6: ["dom", "domingo"],
-            }
-            chaves = mapa.get(dia_idx, [])
-            blocos = []
-            for k in chaves:
-                v = horarios.get(k)
-                if v:
-                    blocos = v
-                    break
-            grade = []
-            for h in blocos or []:
-                inicio = datetime.strptime(h.get("inicio", "08:00"), "%H:%M").time()
-                fim = datetime.strptime(h.get("fim", "17:00"), "%H:%M").time()
-                grade.append((inicio, fim))
-            if grade:
-                return grade
-            # fallback se mapa vazio
-            return [(time(8, 0), time(12, 0)), (time(13, 30), time(17, 30))]
-
-        # Qualquer outro tipo: fallback
-        return [(time(8, 0), time(12, 0)), (time(13, 30), time(17, 30))]
-    except Exception as e:
-        print("Erro ao parsear horario_atendimento:", e)
-        return [(time(8, 0), time(12, 0)), (time(13, 30), time(17, 30))]
+    return obter_grade(conn, id_especialista).janelas(data_referencia)
 
 
 def medico_atende_no_horario(id_especialista, data_str, horario_str, duracao_min, dominio):
@@ -299,7 +393,7 @@ def medico_atende_no_horario(id_especialista, data_str, horario_str, duracao_min
     Verifica se o horário solicitado cai dentro das janelas de atendimento do especialista
     naquele dia específico, considerando a duração.
     """
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info.get("success"):
@@ -313,18 +407,8 @@ def medico_atende_no_horario(id_especialista, data_str, horario_str, duracao_min
             inicio_dt = datetime.combine(data_dt.date(), time(h_parts[0], h_parts[1]))
         except Exception:
             inicio_dt = datetime.combine(data_dt.date(), time(9, 0))
-        fim_dt = inicio_dt + timedelta(minutes=int(duracao_min or 0))
 
-        janelas = _grade_horaria_especialista(conn, id_especialista, data_referencia=data_dt)
-        if not janelas:
-            return False
-        # Verifica se o intervalo solicitado está contido em alguma janela do dia
-        for j_inicio, j_fim in janelas:
-            janela_ini = datetime.combine(data_dt.date(), j_inicio)
-            janela_fim = datetime.combine(data_dt.date(), j_fim)
-            if inicio_dt >= janela_ini and fim_dt <= janela_fim:
-                return True
-        return False
+        return obter_grade(conn, id_especialista).atende(data_dt, inicio_dt.time(), duracao_min)
     except Exception:
         return False
     finally:
@@ -333,6 +417,15 @@ def medico_atende_no_horario(id_especialista, data_str, horario_str, duracao_min
         except Exception:
             pass
 
+def _parse_horario(horario_str):
+    """Aceita "HH:MM" ou "HH:MM:SS"; retorna time ou None se inválido."""
+    try:
+        h_parts = [int(p) for p in str(horario_str).split(":")[:2]]
+        return time(h_parts[0], h_parts[1])
+    except Exception:
+        return None
+
+
 def _gerar_slots(data_dt, duracao_min, conn, id_especialista, janelas=None):
     """
     Gera slots (datetime) para uma data dada, dentro das janelas de trabalho.
@@ -350,51 +443,75 @@ def _gerar_slots(data_dt, duracao_min, conn, id_especialista, janelas=None):
             atual += passo
     return slots
 
-def _horarios_ocupados(conn, id_especialista, data_dt):
+def _counts_por_convenio_no_periodo(conn, ids_especialistas, id_convenio, de_dt, ate_dt):
     """
-    Busca horários já ocupados em 'agendamento' para a data e especialista.
-    Retorna set de strings 'HH:MM'.
+    Lê, numa única consulta ao contador diário, os agendamentos do convênio por
+    especialista e dia no período. Retorna dict {(id_especialista, date): total}.
     """
     cur = conn.cursor()
     cur.execute("""
-        SELECT horario
-        FROM agendamento
-        WHERE id_especialista = %s
-          AND data_agendamento = %s
-    """, (id_especialista, data_dt.date()))
+        SELECT id_especialista, data_agendamento, total
+        FROM agenda_convenio_dia
+        WHERE id_especialista = ANY(%s)
+          AND id_convenio = %s
+          AND data_agendamento BETWEEN %s AND %s
+          AND total > 0
+    """, (list(ids_especialistas), id_convenio, de_dt.date(), ate_dt.date()))
     rows = cur.fetchall()
-    ocupados = set()
-    for r in rows:
-        # se vier como time ou str:
-        h = r["horario"] if isinstance(r, dict) else r[0]
-        if isinstance(h, datetime):
-            ocupados.add(h.strftime("%H:%M"))
-        else:
-            # se for time
-            try:
-                ocupados.add(h.strftime("%H:%M"))
-            except:
-                # se já for string 'HH:MM:SS' ou 'HH:MM'
-                ocupados.add(str(h)[:5])
     cur.close()
-    return ocupados
+    counts = {}
+    for r in rows:
+        dia = r["data_agendamento"]
+        dia = dia.date() if isinstance(dia, datetime) else dia
+        counts[(r["id_especialista"], dia)] = int(r["total"] or 0)
+    return counts
 
-def _count_por_convenio_no_dia(conn, id_especialista, id_convenio, data_dt):
+def _ocupados_no_periodo(conn, ids_especialistas, de_dt, ate_dt):
     """
-    Conta quantos agendamentos existem para aquele especialista/convênio na data.
-    Usa a mesma lógica da sua info_agenda (ajuste o FROM se precisar).
+    Busca numa única consulta (pelo índice GiST de `periodo`) os agendamentos
+    dos especialistas que tocam o período (inclusive). Um agendamento que passa
+    da meia-noite entra nos dois dias.
+    Retorna dict {(id_especialista, date): [(inicio_dt, fim_dt), ...]}.
     """
     cur = conn.cursor()
     cur.execute("""
-        SELECT COUNT(*) 
+        SELECT id_especialista, lower(periodo) AS inicio, upper(periodo) AS fim
         FROM agendamento
-        WHERE id_especialista = %s
-          AND id_convenio = %s
-          AND data_agendamento = %s
-    """, (id_especialista, id_convenio, data_dt.date()))
-    qtd = cur.fetchone()[0]
+        WHERE id_especialista = ANY(%s)
+          AND periodo && tsrange(%s::date, %s::date + 1)
+    """, (list(ids_especialistas), de_dt.date(), ate_dt.date()))
+    rows = cur.fetchall()
     cur.close()
-    return qtd
+    ocupados = {}
+    for r in rows:
+        inicio, fim = r["inicio"], r["fim"]
+        ocupados.setdefault((r["id_especialista"], inicio.date()), []).append((inicio, fim))
+        if fim.date() != inicio.date() and fim.time() != time(0):
+            ocupados.setdefault((r["id_especialista"], fim.date()), []).append((inicio, fim))
+    return ocupados
+
+
+def _sobrepoe(ini_a, fim_a, ini_b, fim_b):
+    # Mesma semântica de `periodo &&` (e do OVERLAPS) usada nas checagens de conflito
+    return (
+        ini_a == ini_b
+        or (ini_a > ini_b and ini_a < fim_b)
+        or (ini_b > ini_a and ini_b < fim_a)
+    )
+
+
+def _slots_livres(dia_dt, duracao_min, janelas, ocupados_do_dia, a_partir_de=None):
+    """Slots do dia dentro das janelas que não colidem com os intervalos ocupados."""
+    passo = timedelta(minutes=int(duracao_min))
+    livres = []
+    for s in _gerar_slots(dia_dt, duracao_min, None, None, janelas=janelas):
+        if a_partir_de is not None and s < a_partir_de:
+            continue
+        if any(_sobrepoe(s, s + passo, o_ini, o_fim) for o_ini, o_fim in ocupados_do_dia):
+            continue
+        livres.append(s)
+    return livres
+
 
 def _score_slot(slot_dt, desejado_dt):
     """
@@ -410,62 +527,63 @@ def sugerir_horarios_ia(id_especialista, id_convenio, data_str, horario_str, dom
     """
     Procura até 3 horários alternativos com uma heurística "IA":
     - varre os próximos dias (até 14 por padrão)
-    - respeita antecedência mínima e cap de convênio por dia
+    - respeita antecedência mínima e cap de convênio por dia (max_consulta 0 = sem limite)
     - evita horários já ocupados
     - ranqueia pela proximidade ao horário desejado
+    A janela inteira é carregada em três consultas (grade, ocupação e contagem por
+    convênio) e o ranqueamento é feito em memória.
     Retorna lista de dicts: [{"data": "YYYY-MM-DD", "horario": "HH:MM"}]
     """
     # Parse entradas
     data_dt = datetime.strptime(data_str, "%Y-%m-%d")
-    try:
-        # Aceita "HH:MM" ou "HH:MM:SS"
-        h_parts = [int(p) for p in horario_str.split(":")[:2]]
-        desejado_dt = datetime.combine(data_dt.date(), time(h_parts[0], h_parts[1]))
-    except:
-        # fallback: 09:00
-        desejado_dt = datetime.combine(data_dt.date(), time(9, 0))
+    # Aceita "HH:MM" ou "HH:MM:SS"; fallback: 09:00
+    desejado = _parse_horario(horario_str) or time(9, 0)
+    duracao = int(tempo_consulta_min or 0)
+    if duracao <= 0:
+        return []
 
     # Conexão
-    conn_info = conexao(dominio)
+    conn_info = conexao(_alvo(dominio))
     if not conn_info["success"]:
         return []
 
     conn = conn_info["connection"]
     hoje = datetime.now()
+    fim_dt = data_dt + timedelta(days=janela_busca_dias)
+    usa_cap = bool(max_consulta) and id_convenio is not None
+
+    try:
+        grade = obter_grade(conn, id_especialista)
+        ocupados = _ocupados_no_periodo(conn, [id_especialista], data_dt, fim_dt)
+        counts = _counts_por_convenio_no_periodo(conn, [id_especialista], id_convenio, data_dt, fim_dt) if usa_cap else {}
+    finally:
+        try:
+            conn.close()
+        except:
+            pass
 
     candidatos_scored = []
 
     for delta in range(janela_busca_dias + 1):
         dia_dt = data_dt + timedelta(days=delta)
+        dia = dia_dt.date()
 
-        # Respeita antecedência mínima
-        if (dia_dt.date() - hoje.date()).days < antecedencia_dias:
+        # Respeita antecedência mínima (mesma conta de dif_datas usada na validação)
+        if (dia_dt - hoje).days < antecedencia_dias:
             continue
 
         # Cap por convênio no dia
-        qtd_conv = _count_por_convenio_no_dia(conn, id_especialista, id_convenio, dia_dt)
-        if qtd_conv >= max_consulta:
+        if usa_cap and counts.get((id_especialista, dia), 0) >= max_consulta:
             # dia cheio para esse convênio
             continue
 
         # Gera slots e remove ocupados
-        ocupados = _horarios_ocupados(conn, id_especialista, dia_dt)
-        slots = _gerar_slots(dia_dt, tempo_consulta_min, conn, id_especialista)
-
-        livres = []
-        for s in slots:
-            hhmm = s.strftime("%H:%M")
-            if hhmm not in ocupados:
-                livres.append(s)
-
-        # Se não há livres, segue para o próximo dia
-        if not livres:
-            continue
+        livres = _slots_livres(dia_dt, duracao, grade.janelas(dia_dt), ocupados.get((id_especialista, dia), []), a_partir_de=hoje)
 
         # Ranqueia pela proximidade ao horário desejado (no dia da consulta original)
         for s in livres:
             # Desejado em outro dia: usa mesmo horário (mesmo hh:mm) para ref
-            desejado_equivalente = datetime.combine(s.date(), desejado_dt.time())
+            desejado_equivalente = datetime.combine(s.date(), desejado)
             score = _score_slot(s, desejado_equivalente) + (delta * 5)  # leve penalização por estar mais distante em dias
             candidatos_scored.append((score, s))
 
@@ -473,7 +591,11 @@ def sugerir_horarios_ia(id_especialista, id_convenio, data_str, horario_str, dom
         if len(candidatos_scored) > 50:
             break
 
-    # Ordena pelos melhores scores e pega top-k
+    return _top_k_slots(candidatos_scored, k)
+
+
+def _top_k_slots(candidatos_scored, k):
+    # Ordena pelos melhores scores e pega top-k (sem repetir data/horário)
     candidatos_scored.sort(key=lambda x: x[0])
     sugestoes = []
     usados = set()
@@ -485,20 +607,189 @@ def sugerir_horarios_ia(id_especialista, id_convenio, data_str, horario_str, dom
         usados.add(chave)
         if len(sugestoes) >= k:
             break
+    return sugestoes
+
 
+DISPONIBILIDADE_MAX_DIAS = 62
+
+
+def disponibilidade_especialista(dominio, id_especialista, de, ate):
+    """
+    Horários livres do especialista entre as datas `de` e `ate` (YYYY-MM-DD, inclusive).
+    Usa uma consulta para a grade/duração e outra para todos os horários ocupados do período.
+    Retorna {"success": True, "data": {"YYYY-MM-DD": ["HH:MM", ...], ...}}.
+    """
     try:
-        conn.close()
-    except:
-        pass
+        de_dt = datetime.strptime(de, "%Y-%m-%d")
+        ate_dt = datetime.strptime(ate, "%Y-%m-%d")
+    except Exception:
+        return {"success": False, "message": "Datas inválidas (use YYYY-MM-DD)"}
+    if ate_dt < de_dt:
+        return {"success": False, "message": "'ate' deve ser igual ou posterior a 'de'"}
+    if (ate_dt - de_dt).days >= DISPONIBILIDADE_MAX_DIAS:
+        return {"success": False, "message": f"Período máximo de {DISPONIBILIDADE_MAX_DIAS} dias"}
 
-    return sugestoes
+    conn_info = conexao(_alvo(dominio))
+    if not conn_info["success"]:
+        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
+    conn = conn_info["connection"]
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT tempo_consulta FROM especialistas WHERE id_especialista = %s",
+            (id_especialista,),
+        )
+        esp = cur.fetchone()
+        cur.close()
+        if not esp:
+            return {"success": False, "message": "Especialista não encontrado"}
+        try:
+            duracao = int(esp["tempo_consulta"] or 0)
+        except (TypeError, ValueError):
+            duracao = 0
+        if duracao <= 0:
+            return {"success": False, "message": "Especialista sem tempo de consulta configurado"}
+
+        grade = obter_grade(conn, id_especialista)
+        ocupados = _ocupados_no_periodo(conn, [id_especialista], de_dt, ate_dt)
+        agora = datetime.now()
+        dias = {}
+        for delta in range((ate_dt - de_dt).days + 1):
+            dia_dt = de_dt + timedelta(days=delta)
+            livres = _slots_livres(dia_dt, duracao, grade.janelas(dia_dt), ocupados.get((id_especialista, dia_dt.date()), []), a_partir_de=agora)
+            dias[dia_dt.date().isoformat()] = [s.strftime("%H:%M") for s in livres]
+        return {"success": True, "data": dias, "duracao": duracao}
+    except Exception as e:
+        return {"success": False, "message": f"Erro ao calcular disponibilidade: {e}"}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_SQL_ESPECIALISTAS_DA_ESPECIALIDADE = """
+    SELECT e.id_especialista,
+           e.nome_especialista,
+           e.horario_atendimento,
+           NULLIF(e.tempo_consulta::text, '')::int AS tempo_consulta,
+           ga.max_consulta,
+           ga.antecedencia
+    FROM especialistas e
+    JOIN especialista_especialidade ee ON ee.id_especialista = e.id_especialista
+    LEFT JOIN LATERAL (
+        SELECT max_consulta, antecedencia
+        FROM gerencia_agenda
+        WHERE id_especialista = e.id_especialista
+          AND id_convenio = %(id_convenio)s
+        LIMIT 1
+    ) ga ON TRUE
+    WHERE ee.id_especialidade = %(id_especialidade)s
+      AND (%(id_convenio)s::int IS NULL OR (
+           e.aceita_convenio
+           AND EXISTS (SELECT 1 FROM {tabela_especialista_convenios} ec
+                        WHERE ec.id_especialista = e.id_especialista
+                          AND ec.id_convenio = %(id_convenio)s)))
+    ORDER BY e.id_especialista
+"""
+
+
+def horarios_livres_por_especialidade(dominio, id_especialidade, id_convenio, de, ate, horario=None, k=5):
+    """
+    Primeiros horários livres entre todos os especialistas de uma especialidade
+    (e que atendem o convênio, se informado), entre `de` e `ate` (YYYY-MM-DD, inclusive).
+    - sem `horario`: ordena do mais cedo para o mais tarde
+    - com `horario`: ranqueia pela proximidade, como em sugerir_horarios_ia
+    Respeita antecedência mínima e cap diário do convênio (gerencia_agenda).
+    Usa três consultas no total, independente do número de especialistas.
+    Retorna {"success": True, "data": [{"id_especialista", "nome_especialista", "data", "horario", "duracao"}, ...]}.
+    """
+    try:
+        de_dt = datetime.strptime(de, "%Y-%m-%d")
+        ate_dt = datetime.strptime(ate, "%Y-%m-%d")
+    except Exception:
+        return {"success": False, "message": "Datas inválidas (use YYYY-MM-DD)"}
+    if ate_dt < de_dt:
+        return {"success": False, "message": "'ate' deve ser igual ou posterior a 'de'"}
+    if (ate_dt - de_dt).days >= DISPONIBILIDADE_MAX_DIAS:
+        return {"success": False, "message": f"Período máximo de {DISPONIBILIDADE_MAX_DIAS} dias"}
+    desejado = None
+    if horario:
+        desejado = _parse_horario(horario)
+        if desejado is None:
+            return {"success": False, "message": "Horário inválido (use HH:MM)"}
+
+    conn_info = conexao(_alvo(dominio))
+    if not conn_info["success"]:
+        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
+    conn = conn_info["connection"]
+    try:
+        cur = conn.cursor()
+        cur.execute(_SQL_ESPECIALISTAS_DA_ESPECIALIDADE.format(**dialeto(conn)._asdict()), {
+            "id_especialidade": id_especialidade,
+            "id_convenio": id_convenio,
+        })
+        especialistas = cur.fetchall()
+        cur.close()
+        ids = [e["id_especialista"] for e in especialistas]
+        if not ids:
+            return {"success": True, "data": []}
+
+        # A grade já veio na consulta acima: compila e aproveita para aquecer o cache
+        grades = {e["id_especialista"]: registrar_grade(conn.host, e["id_especialista"], e["horario_atendimento"]) for e in especialistas}
+        ocupados = _ocupados_no_periodo(conn, ids, de_dt, ate_dt)
+        counts = _counts_por_convenio_no_periodo(conn, ids, id_convenio, de_dt, ate_dt) if id_convenio is not None else {}
+    except Exception as e:
+        return {"success": False, "message": f"Erro ao buscar horários livres: {e}"}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    hoje = datetime.now()
+    candidatos_scored = []
+    for esp in especialistas:
+        id_esp = esp["id_especialista"]
+        duracao = int(esp["tempo_consulta"] or 0)
+        if duracao <= 0:
+            continue
+        max_consulta = int(esp["max_consulta"] or 0)
+        antecedencia = int(esp["antecedencia"] or 0)
+        for delta in range((ate_dt - de_dt).days + 1):
+            dia_dt = de_dt + timedelta(days=delta)
+            dia = dia_dt.date()
+            # Mesmas regras da validação do agendamento com convênio
+            if (dia_dt - hoje).days < antecedencia:
+                continue
+            if max_consulta and counts.get((id_esp, dia), 0) >= max_consulta:
+                continue
+            livres = _slots_livres(dia_dt, duracao, grades[id_esp].janelas(dia_dt), ocupados.get((id_esp, dia), []), a_partir_de=hoje)
+            for s in livres:
+                if desejado is None:
+                    score = int((s - de_dt).total_seconds() // 60)
+                else:
+                    score = _score_slot(s, datetime.combine(dia, desejado)) + (delta * 5)
+                candidatos_scored.append((score, s, id_esp, esp["nome_especialista"], duracao))
+
+    candidatos_scored.sort(key=lambda c: (c[0], c[1], c[2]))
+    return {"success": True, "data": [
+        {
+            "id_especialista": id_esp,
+            "nome_especialista": nome,
+            "data": s.date().isoformat(),
+            "horario": s.strftime("%H:%M"),
+            "duracao": duracao,
+        }
+        for _, s, id_esp, nome, duracao in candidatos_scored[:k]
+    ]}
 
 
 def horario_disponivel(id_especialista, data, horario, duracao_min, dominio):
     """
     Retorna True se não existir agendamento para o especialista na mesma data e horário.
     """
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -511,7 +802,7 @@ def horario_cliente_disponivel(id_cliente, data, horario, duracao_min, dominio):
     Retorna True se o cliente NÃO possuir outro agendamento na mesma data e horário
     (independente do especialista).
     """
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -524,23 +815,24 @@ def horario_cliente_disponivel(id_cliente, data, horario, duracao_min, dominio):
             SELECT 1
             FROM agendamento
             WHERE id_cliente = %s
-              AND data_agendamento::date = %s::date
-              AND (horario, horario + make_interval(0,0,0,0,0, duracao, 0))
-                  OVERLAPS (%s::time, %s::time + make_interval(0,0,0,0,0, %s, 0))
+              AND periodo && periodo_agendamento(%s::date, %s::time, %s)
             LIMIT 1
             """,
-            (id_cliente, data, horario, horario, int(duracao_min or 0)),
+            (id_cliente, data, horario, int(duracao_min or 0)),
         )
         row = cur.fetchone()
         return row is None
-    except Exception:
-        return False
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
 
 def horario_disponivel(id_especialista, data, horario, duracao_min, dominio):
     """
     Retorna True se não existir agendamento para o especialista na mesma data e horário.
     """
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -554,96 +846,186 @@ def horario_disponivel(id_especialista, data, horario, duracao_min, dominio):
             SELECT 1
             FROM agendamento
             WHERE id_especialista = %s
-              AND data_agendamento::date = %s::date
-              AND (horario, horario + make_interval(0,0,0,0,0, duracao, 0))
-                  OVERLAPS (%s::time, %s::time + make_interval(0,0,0,0,0, %s, 0))
+              AND periodo && periodo_agendamento(%s::date, %s::time, %s)
             LIMIT 1
             """,
-            (id_especialista, data, horario, horario, int(duracao_min or 0)),
+            (id_especialista, data, horario, int(duracao_min or 0)),
         )
         row = cur.fetchone()
         return row is None
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+LISTAGEM_LIMITE_PADRAO = 100
+LISTAGEM_LIMITE_MAX = 500
+
+
+def _codificar_cursor(data_agendamento, horario, id_agendamento):
+    bruto = f"{data_agendamento}|{horario}|{id_agendamento}"
+    return base64.urlsafe_b64encode(bruto.encode("utf-8")).decode("ascii")
+
+
+def _decodificar_cursor(cursor):
+    """Devolve (data, horario, id) do cursor opaco ou None se inválido."""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        data_str, hora_str, id_str = bruto.split("|")
+        data_val = datetime.strptime(data_str, "%Y-%m-%d").date()
+        hora_val = datetime.strptime(hora_str, "%H:%M:%S").time()
+        return data_val, hora_val, int(id_str)
     except Exception:
-        return False
+        return None
+
+
+def _filtros_listagem(de, ate, id_especialista, id_cliente):
+    """Cláusulas WHERE (e parâmetros) comuns à listagem e à exportação. Datas inválidas levantam ValueError."""
+    filtros = []
+    params = []
+    if de:
+        filtros.append("a.data_agendamento >= %s")
+        params.append(datetime.strptime(de, "%Y-%m-%d").date())
+    if ate:
+        # Limite aberto no dia seguinte: inclui o dia inteiro mesmo se a coluna for timestamp
+        filtros.append("a.data_agendamento < %s::date + 1")
+        params.append(datetime.strptime(ate, "%Y-%m-%d").date())
+    if id_especialista is not None:
+        filtros.append("a.id_especialista = %s")
+        params.append(id_especialista)
+    if id_cliente is not None:
+        filtros.append("a.id_cliente = %s")
+        params.append(id_cliente)
+    return filtros, params
+
+
+# Colunas da listagem já no formato da API (data ISO, horário HH:MM), prontas para o JSON
+_COLUNAS_LISTAGEM = """
+    a.id_agendamento, a.id_especialista, a.id_cliente,
+    to_char(a.data_agendamento, 'YYYY-MM-DD') AS data_agendamento,
+    to_char(a.horario, 'HH24:MI') AS horario,
+    a.duracao, e.nome_especialista, e.cor
+"""
+
+
+def listar_agendamentos(dominio, de=None, ate=None, id_especialista=None, id_cliente=None, limite=None, cursor=None):
+    """
+    Lista agendamentos com o nome/cor do especialista, ordenados por data, horário e id.
+    Filtros opcionais: `de`/`ate` (YYYY-MM-DD, inclusive), id_especialista, id_cliente.
+    Paginação por keyset: devolve no máximo `limite` linhas (LISTAGEM_LIMITE_PADRAO
+    se não informado, até LISTAGEM_LIMITE_MAX) e `proximo_cursor` para a página
+    seguinte (None na última).
+    """
+    limite = min(max(int(limite or LISTAGEM_LIMITE_PADRAO), 1), LISTAGEM_LIMITE_MAX)
 
+    try:
+        filtros, params = _filtros_listagem(de, ate, id_especialista, id_cliente)
+    except ValueError:
+        return {"success": False, "message": "Datas inválidas (use YYYY-MM-DD)"}
+    if cursor:
+        posicao = _decodificar_cursor(cursor)
+        if posicao is None:
+            return {"success": False, "message": "Cursor inválido"}
+        # Comparação de linha: mesma ordem do ORDER BY, aproveita índice em (data, horario, id).
+        # O cursor guarda só o dia: o ::date (sem efeito quando a coluna já é date, o
+        # esquema canônico) mantém a ordem correta se algum tenant tiver timestamp
+        filtros.append("(a.data_agendamento::date, a.horario, a.id_agendamento) > (%s, %s, %s)")
+        params.extend(posicao)
+
+    # O horário completo da última linha vai para o cursor
+    sql = "SELECT " + _COLUNAS_LISTAGEM + ", to_char(a.horario, 'HH24:MI:SS') AS horario_cursor" + """
+        FROM agendamento a
+        LEFT JOIN especialistas e ON e.id_especialista = a.id_especialista
+    """
+    if filtros:
+        sql += " WHERE " + " AND ".join(filtros)
+    # Uma linha a mais só para saber se existe próxima página
+    sql += " ORDER BY a.data_agendamento::date ASC, a.horario ASC, a.id_agendamento ASC LIMIT %s"
+    params.append(limite + 1)
 
-def listar_agendamentos(dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
         return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
     conn = conn_info["connection"]
     try:
-        def _has_table(conn, table_name):
-            try:
-                with conn.cursor() as _c:
-                    _c.execute("SELECT 1 FROM information_schema.tables WHERE table_name=%s LIMIT 1", (table_name,))
-                    return _c.fetchone() is not None
-            except Exception:
-                return False
-
         cur = conn.cursor()
-        # Versão simples e estável: lista agendamentos com nome do especialista
-        cur.execute(
-            """
-            SELECT a.id_agendamento, a.id_especialista, a.id_cliente, a.data_agendamento, a.horario, a.duracao,
-                   e.nome_especialista, e.cor
-            FROM agendamento a
-            LEFT JOIN especialistas e ON e.id_especialista = a.id_especialista
-            ORDER BY a.data_agendamento ASC, a.horario ASC
-            """
-        )
+        cur.execute(sql, params)
         rows = cur.fetchall() or []
-        ags = []
+        cur.close()
+
+        proximo_cursor = None
+        if len(rows) > limite:
+            rows = rows[:limite]
+            ultimo = rows[-1]
+            proximo_cursor = _codificar_cursor(ultimo["data_agendamento"], ultimo["horario_cursor"], ultimo["id_agendamento"])
         for r in rows:
-            is_dict = isinstance(r, dict)
-            id_ag = r["id_agendamento"] if is_dict else r[0]
-            id_esp = r["id_especialista"] if is_dict else r[1]
-            id_cli = r["id_cliente"] if is_dict else r[2]
-            data_val = r["data_agendamento"] if is_dict else r[3]
-            hora_val = r["horario"] if is_dict else r[4]
-            dur = r["duracao"] if is_dict else r[5]
-            nome_esp = r.get("nome_especialista") if is_dict else r[6]
-            cor = r.get("cor") if is_dict else r[7]
-
-            # normalizações
-            try:
-                # date/datetime -> ISO (YYYY-MM-DD)
-                if hasattr(data_val, "isoformat"):
-                    data_str = data_val.isoformat()
-                else:
-                    data_str = str(data_val)
-            except Exception:
-                data_str = str(data_val)
-
-            try:
-                # time/datetime -> HH:MM
-                if hasattr(hora_val, "strftime"):
-                    hora_str = hora_val.strftime("%H:%M")
-                else:
-                    hora_str = str(hora_val)[:5]
-            except Exception:
-                hora_str = str(hora_val)[:5]
-
-            ags.append({
-                "id_agendamento": id_ag,
-                "id_especialista": id_esp,
-                "id_cliente": id_cli,
-                "data_agendamento": data_str,
-                "horario": hora_str,
-                "duracao": dur,
-                "nome_especialista": nome_esp,
-                "cor": cor,
-            })
-        return {"success": True, "agendamentos": ags}
+            del r["horario_cursor"]
+
+        # As linhas do RealDictCursor já saem no formato final
+        return {"success": True, "agendamentos": rows, "proximo_cursor": proximo_cursor}
     except Exception as e:
         try:
             print("Erro ao listar agendamentos:", e)
         except Exception:
             pass
         # Fallback: não derruba a listagem; retorna vazio para não quebrar o frontend
-        return {"success": True, "agendamentos": []}
+        return {"success": True, "agendamentos": [], "proximo_cursor": None}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+def resumo_agendamentos(dominio, hoje, agora=None):
+    """
+    Contagens do dashboard calculadas no banco: agendamentos no dia `hoje`
+    (YYYY-MM-DD, a data local do cliente), na semana (segunda a domingo) e no mês
+    que o contêm, e futuros a partir de `agora` (HH:MM; 00:00 se omitido).
+    """
+    try:
+        dia = datetime.strptime(hoje, "%Y-%m-%d").date()
+        hora = datetime.strptime(agora or "00:00", "%H:%M").time()
+    except (TypeError, ValueError):
+        return {"success": False, "message": "Informe hoje (YYYY-MM-DD) e agora (HH:MM)"}
+    semana_de = dia - timedelta(days=dia.weekday())
+    mes_de = dia.replace(day=1)
+    mes_ate = (mes_de + timedelta(days=32)).replace(day=1)
+    params = {
+        "hoje": dia, "agora": hora,
+        "semana_de": semana_de, "semana_ate": semana_de + timedelta(days=7),
+        "mes_de": mes_de, "mes_ate": mes_ate,
+        "inicio": min(semana_de, mes_de),
+    }
+
+    ip = busca_ip(dominio)
+    alvo = ip or dominio
+    conn_info = conexao(alvo)
+    if not conn_info["success"]:
+        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
+    conn = conn_info["connection"]
+    try:
+        cur = conn.cursor()
+        # Limites abertos no dia seguinte, como na listagem
+        cur.execute("""
+            SELECT
+                count(*) FILTER (WHERE data_agendamento >= %(hoje)s AND data_agendamento < %(hoje)s::date + 1) AS hoje,
+                count(*) FILTER (WHERE data_agendamento >= %(semana_de)s AND data_agendamento < %(semana_ate)s) AS semana,
+                count(*) FILTER (WHERE data_agendamento >= %(mes_de)s AND data_agendamento < %(mes_ate)s) AS mes,
+                count(*) FILTER (WHERE (data_agendamento::date, horario) >= (%(hoje)s, %(agora)s)) AS futuros
+            FROM agendamento
+            WHERE data_agendamento >= %(inicio)s
+        """, params)
+        row = cur.fetchone() or {}
+        cur.close()
+        return {"success": True, "resumo": {k: int(row.get(k) or 0) for k in ("hoje", "semana", "mes", "futuros")}}
+    except Exception as e:
+        print("Erro ao resumir agendamentos:", e)
+        return {"success": False, "message": "Erro ao resumir agendamentos"}
     finally:
         try:
             conn.close()
@@ -651,8 +1033,217 @@ def listar_agendamentos(dominio):
             pass
 
 
+EXPORTACAO_FORMATOS = ("ndjson", "csv")
+EXPORTACAO_COLUNAS = ("id_agendamento", "id_especialista", "nome_especialista", "id_cliente",
+                      "data_agendamento", "horario", "duracao", "id_convenio")
+# Linhas buscadas do servidor por ida ao banco no cursor nomeado
+EXPORTACAO_LOTE = 2000
+
+
+def exportar_agendamentos(dominio, formato="ndjson", de=None, ate=None, id_especialista=None, id_cliente=None):
+    """
+    Prepara a exportação completa dos agendamentos (mesmos filtros da listagem).
+    As linhas são lidas por um cursor nomeado (server-side), em lotes de
+    EXPORTACAO_LOTE, e entregues uma a uma já serializadas: a memória usada não
+    cresce com o tamanho do tenant.
+    Retorna {"success": True, "linhas": <gerador de str>, "mimetype": ...} ou o erro.
+    """
+    formato = (formato or "ndjson").lower()
+    if formato not in EXPORTACAO_FORMATOS:
+        return {"success": False, "message": "Formato inválido (use ndjson ou csv)"}
+    try:
+        filtros, params = _filtros_listagem(de, ate, id_especialista, id_cliente)
+    except ValueError:
+        return {"success": False, "message": "Datas inválidas (use YYYY-MM-DD)"}
+
+    sql = """
+        SELECT a.id_agendamento, a.id_especialista, e.nome_especialista, a.id_cliente,
+               to_char(a.data_agendamento, 'YYYY-MM-DD') AS data_agendamento,
+               to_char(a.horario, 'HH24:MI') AS horario,
+               a.duracao, a.id_convenio
+        FROM agendamento a
+        LEFT JOIN especialistas e ON e.id_especialista = a.id_especialista
+    """
+    if filtros:
+        sql += " WHERE " + " AND ".join(filtros)
+    sql += " ORDER BY a.data_agendamento ASC, a.horario ASC, a.id_agendamento ASC"
+
+    conn_info = conexao(_alvo(dominio))
+    if not conn_info["success"]:
+        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
+
+    mimetype = "application/x-ndjson" if formato == "ndjson" else "text/csv"
+    return {"success": True, "linhas": _linhas_exportacao(conn_info["connection"], sql, params, formato), "mimetype": mimetype}
+
+
+def _linhas_exportacao(conn, sql, params, formato):
+    # A conexão só volta ao pool quando o gerador termina (ou é fechado pelo servidor)
+    try:
+        cur = conn.cursor(name="exportacao_agendamentos")
+        cur.itersize = EXPORTACAO_LOTE
+        cur.execute(sql, params)
+        if formato == "csv":
+            buffer = io.StringIO()
+            escritor = csv.writer(buffer)
+            escritor.writerow(EXPORTACAO_COLUNAS)
+        for r in cur:
+            if formato == "ndjson":
+                yield json_rapido.dumps(r) + "\n"
+            else:
+                escritor.writerow(r.values())
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+        if formato == "csv" and buffer.tell():
+            yield buffer.getvalue()
+        cur.close()
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# Alterações com até tantos segundos são reenviadas mesmo abaixo do cursor: cobrem
+# transações que gravaram no log antes de outras e confirmaram depois delas
+ALTERACOES_JANELA_SEGUNDOS = int(os.getenv("ALTERACOES_JANELA_SEGUNDOS", "30"))
+# Linhas do log mais antigas que isso são apagadas (0 = nunca)
+ALTERACOES_RETENCAO_DIAS = int(os.getenv("ALTERACOES_RETENCAO_DIAS", "7"))
+# De quanto em quanto tempo (segundos) cada processo limpa o log de um tenant
+ALTERACOES_LIMPEZA_INTERVALO = int(os.getenv("ALTERACOES_LIMPEZA_INTERVALO", "3600"))
+_ultima_limpeza = {}
+_ultima_limpeza_lock = threading.Lock()
+
+
+def _limpar_alteracoes(conn, host):
+    """Apaga do log as linhas além da retenção, no máximo uma vez por intervalo por host."""
+    if ALTERACOES_RETENCAO_DIAS <= 0:
+        return
+    agora = _relogio.monotonic()
+    with _ultima_limpeza_lock:
+        ultima = _ultima_limpeza.get(host)
+        if ultima is not None and agora - ultima < ALTERACOES_LIMPEZA_INTERVALO:
+            return
+        _ultima_limpeza[host] = agora
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM agendamento_alteracoes WHERE alterado_em < now() - make_interval(days => %s)",
+            (ALTERACOES_RETENCAO_DIAS,),
+        )
+    conn.commit()
+
+
+def alteracoes_agendamentos(dominio, since=None):
+    """
+    Agendamentos inseridos, alterados ou removidos desde o cursor `since`.
+    O log é gravado por trigger (migração 7), então vale também para alterações
+    feitas fora da API. O cursor é o maior id do log já visto; as linhas dos
+    últimos ALTERACOES_JANELA_SEGUNDOS voltam mesmo com id menor, para não pular
+    uma transação que confirmou depois de outra com id maior. Um agendamento
+    pode então vir repetido em consultas seguintes, sempre com o estado atual.
+    Cada agendamento aparece uma vez por resposta, com o estado atual (ou
+    operacao "delete").
+    Sem `since` devolve lista vazia e o cursor atual, para o cliente começar a
+    acompanhar depois da carga inicial.
+    Retorna {"success": True, "alteracoes": [...], "cursor": "<str>"}.
+    """
+    desde = None
+    if since not in (None, ""):
+        try:
+            desde = int(since)
+        except (TypeError, ValueError):
+            return {"success": False, "message": "Cursor inválido"}
+
+    alvo = _alvo(dominio)
+    conn_info = conexao(alvo)
+    if not conn_info["success"]:
+        return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
+    conn = conn_info["connection"]
+    try:
+        _limpar_alteracoes(conn, alvo)
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(max(id), 0) AS id FROM agendamento_alteracoes")
+        ate = int(cur.fetchone()["id"])
+        if desde is None:
+            cur.close()
+            return {"success": True, "alteracoes": [], "cursor": str(ate)}
+
+        # Inserido e alterado dentro da mesma janela ainda é novidade para o cliente
+        cur.execute("""
+            SELECT CASE WHEN a.id_agendamento IS NULL THEN 'delete'
+                        WHEN l.primeira_operacao = 'I' THEN 'insert'
+                        ELSE 'update' END AS operacao,
+                   l.id_agendamento,
+                   CASE WHEN a.id_agendamento IS NOT NULL THEN json_build_object(
+                       'id_agendamento', a.id_agendamento,
+                       'id_especialista', a.id_especialista,
+                       'id_cliente', a.id_cliente,
+                       'data_agendamento', to_char(a.data_agendamento, 'YYYY-MM-DD'),
+                       'horario', to_char(a.horario, 'HH24:MI'),
+                       'duracao', a.duracao,
+                       'nome_especialista', e.nome_especialista,
+                       'cor', e.cor
+                   ) END AS agendamento
+            FROM (
+                SELECT id_agendamento,
+                       (array_agg(operacao ORDER BY id))[1] AS primeira_operacao
+                FROM agendamento_alteracoes
+                WHERE id <= %(ate)s
+                  AND (id > %(desde)s OR alterado_em >= now() - make_interval(secs => %(janela)s))
+                GROUP BY id_agendamento
+            ) l
+            LEFT JOIN agendamento a ON a.id_agendamento = l.id_agendamento
+            LEFT JOIN especialistas e ON e.id_especialista = a.id_especialista
+            ORDER BY l.id_agendamento
+        """, {"desde": desde, "ate": ate, "janela": ALTERACOES_JANELA_SEGUNDOS})
+        alteracoes = cur.fetchall()
+        cur.close()
+        return {"success": True, "alteracoes": alteracoes, "cursor": str(ate)}
+    except Exception as e:
+        return {"success": False, "message": f"Erro ao buscar alterações: {e}"}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_SQL_ATUALIZA_SEM_CONFLITO = """
+    WITH conflitos AS (
+        SELECT
+            EXISTS (SELECT 1 FROM agendamento a
+                     WHERE a.id_especialista = %(id_especialista)s
+                       AND a.id_agendamento <> %(id_agendamento)s
+                       AND a.periodo && periodo_agendamento(%(data)s::date, %(horario)s::time, %(duracao)s)
+            ) AS especialista,
+            EXISTS (SELECT 1 FROM agendamento a
+                     WHERE a.id_cliente = %(id_cliente)s
+                       AND a.id_agendamento <> %(id_agendamento)s
+                       AND a.periodo && periodo_agendamento(%(data)s::date, %(horario)s::time, %(duracao)s)
+            ) AS cliente
+    ), alterado AS (
+        UPDATE agendamento
+           SET id_cliente = %(id_cliente)s,
+               id_especialista = %(id_especialista)s,
+               data_agendamento = %(data)s,
+               horario = %(horario)s
+          FROM conflitos
+         WHERE id_agendamento = %(id_agendamento)s
+           AND NOT conflitos.especialista AND NOT conflitos.cliente
+        RETURNING id_agendamento
+    )
+    SELECT conflitos.especialista, conflitos.cliente, (SELECT id_agendamento FROM alterado) AS id_agendamento
+    FROM conflitos
+"""
+
+
 def atualizar_agendamento(id_agendamento, id_cliente, id_especialista, data, horario, dominio):
-    ip = busca_ip(dominio) if dominio else None
+    """
+    Altera cliente, especialista, data e/ou horário (None mantém o atual) com a
+    mesma garantia de realiza_agendamento: trava os dias de destino e só grava se
+    o novo intervalo não sobrepuser outro agendamento do especialista ou do cliente.
+    """
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -662,20 +1253,34 @@ def atualizar_agendamento(id_agendamento, id_cliente, id_especialista, data, hor
         cur = conn.cursor()
         cur.execute(
             """
-            UPDATE agendamento
-               SET id_cliente = COALESCE(%s, id_cliente),
-                   id_especialista = COALESCE(%s, id_especialista),
-                   data_agendamento = COALESCE(%s, data_agendamento),
-                   horario = COALESCE(%s, horario)
-             WHERE id_agendamento = %s
-            RETURNING id_agendamento
+            SELECT id_cliente, id_especialista, data_agendamento::date AS data_agendamento, horario, duracao
+            FROM agendamento
+            WHERE id_agendamento = %s
+            FOR UPDATE
             """,
-            (id_cliente, id_especialista, data, horario, id_agendamento)
+            (id_agendamento,)
         )
+        atual = cur.fetchone()
+        if not atual:
+            conn.rollback()
+            return {"success": False, "message": "Agendamento não encontrado"}
+
+        novo = {
+            "id_agendamento": id_agendamento,
+            "id_cliente": id_cliente if id_cliente is not None else atual["id_cliente"],
+            "id_especialista": id_especialista if id_especialista is not None else atual["id_especialista"],
+            "data": datetime.strptime(data, "%Y-%m-%d").date() if data else atual["data_agendamento"],
+            "horario": horario if horario is not None else atual["horario"],
+            "duracao": int(atual["duracao"] or 0),
+        }
+        _travar_periodo(cur, novo["id_especialista"], novo["id_cliente"], novo["data"], novo["horario"], novo["duracao"])
+        cur.execute(_SQL_ATUALIZA_SEM_CONFLITO, novo)
         row = cur.fetchone()
         conn.commit()
-        if not row:
-            return {"success": False, "message": "Agendamento não encontrado"}
+        if row["id_agendamento"] is None:
+            if row["cliente"]:
+                return {"success": False, "code": "HORARIO_OCUPADO", "message": "Cliente já possui agendamento neste horário"}
+            return {"success": False, "code": "HORARIO_OCUPADO", "message": "Horário já ocupado para este especialista"}
         return {"success": True}
     except Exception as e:
         try:
@@ -683,10 +1288,15 @@ def atualizar_agendamento(id_agendamento, id_cliente, id_especialista, data, hor
         except Exception:
             pass
         return {"success": False, "message": f"Erro ao atualizar agendamento: {e}"}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
 
 
 def remover_agendamento(id_agendamento, dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -705,4 +1315,9 @@ def remover_agendamento(id_agendamento, dominio):
             conn.rollback()
         except Exception:
             pass
-        return {"success": False, "message": f"Erro ao remover agendamento: {e}"}
\ No newline at end of file
+        return {"success": False, "message": f"Erro ao remover agendamento: {e}"}
+    finally:
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -1,10 +1,23 @@
+import hashlib
 import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Tuple, Optional, Dict, Any
 
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
 
+# Quantos tokens já verificados manter em memória (por processo)
+TOKEN_CACHE_MAX = int(os.getenv("TOKEN_CACHE_MAX", "4096"))
+# Validade do ticket de conexão ao serviço de eventos da agenda (segundos)
+SSE_TICKET_TTL = int(os.getenv("SSE_TICKET_TTL", "30"))
+
+_MAX_AGE_PADRAO = 60 * 60 * 24
+
+
 def _get_secret() -> str:
     # Prefer strong secret from env; fallback to static for dev only
     return (
@@ -14,8 +27,29 @@ def _get_secret() -> str:
     )
 
 
+def _get_secrets():
+    # Rotação de chave: tokens assinados com as chaves de JWT_SECRET_ANTERIORES
+    # (separadas por vírgula) continuam válidos; os novos usam só a atual
+    anteriores = [s.strip() for s in os.getenv("JWT_SECRET_ANTERIORES", "").split(",") if s.strip()]
+    return anteriores + [_get_secret()]
+
+
+_serializer = URLSafeTimedSerializer(_get_secrets(), salt="auth-token")
+# Salt próprio: um ticket nunca vale como token de sessão, nem o contrário
+_serializer_tickets = URLSafeTimedSerializer(_get_secrets(), salt="eventos-agenda")
+
+
 def _get_serializer() -> URLSafeTimedSerializer:
-    return URLSafeTimedSerializer(_get_secret())
+    return _serializer
+
+
+# digest do token -> (payload, assinado_em, exp), em ordem de uso
+_verificados = OrderedDict()
+_verificados_lock = threading.Lock()
+
+
+def _digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
 
 
 def create_token(payload: Dict[str, Any], expires_in_seconds: int = 60 * 60 * 8) -> str:
@@ -24,14 +58,31 @@ def create_token(payload: Dict[str, Any], expires_in_seconds: int = 60 * 60 * 8)
     data.setdefault("iat", int(datetime.utcnow().timestamp()))
     data.setdefault("exp", int((datetime.utcnow() + timedelta(seconds=expires_in_seconds)).timestamp()))
     s = _get_serializer()
-    return s.dumps(data, salt="auth-token")
+    return s.dumps(data)
 
 
 def verify_token(token: str, max_age_seconds: Optional[int] = None) -> Tuple[bool, Optional[Dict[str, Any]], str]:
+    """
+    Valida o token. Tokens já verificados ficam num LRU (chave = SHA-256 do
+    token) até o `exp` do próprio token, então as requisições seguintes da
+    mesma sessão não refazem HMAC nem decodificam o JSON.
+    """
+    max_age = max_age_seconds or _MAX_AGE_PADRAO
+    chave = _digest(token)
+    agora = time.time()
+
+    with _verificados_lock:
+        item = _verificados.get(chave)
+        if item is not None:
+            payload, assinado_em, exp = item
+            if agora < exp and agora - assinado_em <= max_age:
+                _verificados.move_to_end(chave)
+                return True, dict(payload), ""
+            del _verificados[chave]
+
     s = _get_serializer()
     try:
-        payload = s.loads(token, salt="auth-token", max_age=max_age_seconds or 60 * 60 * 24)
-        return True, payload, ""
+        payload, assinado_em = s.loads(token, max_age=max_age, return_timestamp=True)
     except SignatureExpired:
         return False, None, "Token expirado"
     except BadSignature:
@@ -39,4 +90,37 @@ def verify_token(token: str, max_age_seconds: Optional[int] = None) -> Tuple[boo
     except Exception as e:
         return False, None, f"Falha ao validar token: {e}"
 
+    if TOKEN_CACHE_MAX > 0 and isinstance(payload, dict):
+        try:
+            exp = float(payload.get("exp"))
+        except (TypeError, ValueError):
+            exp = 0
+        if exp > agora:
+            with _verificados_lock:
+                _verificados[chave] = (payload, assinado_em.timestamp(), exp)
+                _verificados.move_to_end(chave)
+                while len(_verificados) > TOKEN_CACHE_MAX:
+                    _verificados.popitem(last=False)
+    return True, dict(payload) if isinstance(payload, dict) else payload, ""
+
+
+def criar_ticket_eventos(tenant: str) -> str:
+    """
+    Ticket curto para abrir o stream de eventos da agenda. Vai na URL (o
+    EventSource não envia cabeçalhos), por isso leva só o tenant e um nonce:
+    vale SSE_TICKET_TTL segundos e o serviço de eventos aceita cada um uma vez.
+    """
+    return _serializer_tickets.dumps({"tenant": tenant, "nonce": secrets.token_urlsafe(12)})
 
+
+def verificar_ticket_eventos(ticket: str) -> Tuple[bool, Optional[Dict[str, Any]], str]:
+    """Valida assinatura e validade do ticket. Retorna (ok, {"tenant", "nonce"}, erro)."""
+    try:
+        dados = _serializer_tickets.loads(ticket, max_age=SSE_TICKET_TTL)
+    except SignatureExpired:
+        return False, None, "Ticket expirado"
+    except BadSignature:
+        return False, None, "Ticket inválido"
+    if not isinstance(dados, dict) or not dados.get("tenant") or not dados.get("nonce"):
+        return False, None, "Ticket inválido"
+    return True, dados, ""
@@ -0,0 +1,165 @@
+import heapq
+import itertools
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import namedtuple
+
+
+# Mensagens aguardando envio por processo; com a fila cheia o pedido é recusado
+EMAIL_FILA_MAX = int(os.getenv("EMAIL_FILA_MAX", "1000"))
+# Quantas mensagens enviar seguidas na mesma sessão SMTP antes de voltar à fila
+EMAIL_LOTE = int(os.getenv("EMAIL_LOTE", "20"))
+# Tentativas por mensagem; entre elas a mensagem aguarda 1s, 2s, 4s... (até 60s)
+# sem segurar as demais
+EMAIL_TENTATIVAS = int(os.getenv("EMAIL_TENTATIVAS", "5"))
+# Sessão SMTP sem uso por mais que isso (segundos) é encerrada
+EMAIL_SMTP_OCIOSO = float(os.getenv("EMAIL_SMTP_OCIOSO", "60"))
+
+ConfigSMTP = namedtuple("ConfigSMTP", ["servidor", "porta", "tls", "usuario", "senha"])
+
+
+def config_smtp(config):
+    """ConfigSMTP a partir das chaves MAIL_* da configuração do Flask."""
+    return ConfigSMTP(
+        config.get("MAIL_SERVER"),
+        config.get("MAIL_PORT"),
+        bool(config.get("MAIL_USE_TLS")),
+        config.get("MAIL_USERNAME"),
+        config.get("MAIL_PASSWORD"),
+    )
+
+
+class CaixaSaida(threading.Thread):
+    """
+    Envia em segundo plano as mensagens enfileiradas pelas requisições,
+    reaproveitando uma sessão SMTP já autenticada (STARTTLS e login só na
+    primeira mensagem ou após queda). Uma mensagem com erro temporário vai para
+    os adiados (heap por horário da próxima tentativa, com espera progressiva) e
+    a thread segue com as demais; recusas definitivas (5xx) descartam a mensagem.
+    """
+
+    def __init__(self):
+        super().__init__(name="caixa-saida-email", daemon=True)
+        self.fila = queue.Queue(maxsize=EMAIL_FILA_MAX)
+        # (não antes de, ordem, item, tentativa) — só a thread da caixa mexe
+        self._adiados = []
+        self._ordem = itertools.count()
+        self._smtp = None
+        self._config = None
+        self._usada_em = 0.0
+
+    def _sessao(self, config):
+        if self._smtp is not None and self._config != config:
+            self._fechar()
+        if self._smtp is None:
+            smtp = smtplib.SMTP(config.servidor, config.porta, timeout=30)
+            if config.tls:
+                smtp.starttls()
+            if config.usuario:
+                smtp.login(config.usuario, config.senha)
+            self._smtp, self._config = smtp, config
+        self._usada_em = time.monotonic()
+        return self._smtp
+
+    def _fechar(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                try:
+                    self._smtp.close()
+                except Exception:
+                    pass
+        self._smtp, self._config = None, None
+
+    def _enviar(self, item, tentativa=1):
+        """Uma tentativa de envio; em erro temporário a mensagem é adiada com espera progressiva."""
+        config, remetente, destinatarios, mensagem = item
+        try:
+            self._sessao(config).sendmail(remetente, destinatarios, mensagem)
+            return True
+        except smtplib.SMTPResponseException as e:
+            if 500 <= e.smtp_code < 600:
+                print(f"E-mail para {destinatarios} recusado: {e.smtp_code} {e.smtp_error!r}")
+                return False
+            erro = e
+        except (smtplib.SMTPException, OSError) as e:
+            erro = e
+        # Descarta a sessão: a próxima mensagem reconecta
+        self._fechar()
+        if tentativa < EMAIL_TENTATIVAS:
+            espera = min(2 ** (tentativa - 1), 60)
+            heapq.heappush(self._adiados, (time.monotonic() + espera, next(self._ordem), item, tentativa + 1))
+        else:
+            print(f"Falha ao enviar e-mail para {destinatarios} após {EMAIL_TENTATIVAS} tentativas: {erro}")
+        return False
+
+    def _proximo_lote(self):
+        """
+        Até EMAIL_LOTE pares (item, tentativa): primeiro os adiados já vencidos,
+        depois a fila. Sem nada a enviar, aguarda a fila até o próximo adiado
+        vencer (ou EMAIL_SMTP_OCIOSO) e pode devolver lista vazia.
+        """
+        agora = time.monotonic()
+        lote = []
+        while self._adiados and self._adiados[0][0] <= agora and len(lote) < EMAIL_LOTE:
+            _, _, item, tentativa = heapq.heappop(self._adiados)
+            lote.append((item, tentativa))
+        if not lote:
+            espera = EMAIL_SMTP_OCIOSO
+            if self._adiados:
+                espera = min(espera, self._adiados[0][0] - agora)
+            try:
+                lote.append((self.fila.get(timeout=espera), 1))
+            except queue.Empty:
+                return lote
+        while len(lote) < EMAIL_LOTE:
+            try:
+                lote.append((self.fila.get_nowait(), 1))
+            except queue.Empty:
+                break
+        return lote
+
+    def run(self):
+        while True:
+            lote = self._proximo_lote()
+            if not lote:
+                if time.monotonic() - self._usada_em >= EMAIL_SMTP_OCIOSO:
+                    self._fechar()
+                continue
+            for item, tentativa in lote:
+                try:
+                    self._enviar(item, tentativa)
+                except Exception as e:
+                    print(f"Erro inesperado na caixa de saída: {e}")
+                    self._fechar()
+
+
+_caixa = None
+_caixa_lock = threading.Lock()
+
+
+def _caixa_do_processo():
+    # Criada no primeiro uso: com gunicorn, cada worker (pós-fork) tem a sua thread
+    global _caixa
+    with _caixa_lock:
+        if _caixa is None:
+            _caixa = CaixaSaida()
+            _caixa.start()
+        return _caixa
+
+
+def enfileirar(config, mensagem, destinatarios):
+    """
+    Coloca a mensagem (email.message) na fila de envio e retorna na hora.
+    `config` é um ConfigSMTP. Retorna False se a fila estiver cheia.
+    """
+    item = (config, mensagem["From"], list(destinatarios), mensagem.as_string())
+    try:
+        _caixa_do_processo().fila.put_nowait(item)
+        return True
+    except queue.Full:
+        return False
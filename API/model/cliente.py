@@ -5,7 +5,7 @@ from model.login import busca_ip
 def listar(dominio):
     if not dominio:
         return {"success": False, "message": "Parâmetro 'dominio' é obrigatório"}
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info.get('success'):
@@ -32,7 +32,7 @@ def listar(dominio):
 def criar(dominio, payload):
     if not dominio:
         return {"success": False, "message": "Parâmetro 'dominio' é obrigatório"}
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info.get('success'):
@@ -66,7 +66,7 @@ def criar(dominio, payload):
 def atualizar(dominio, id_cliente, payload):
     if not dominio:
         return {"success": False, "message": "Parâmetro 'dominio' é obrigatório"}
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info.get('success'):
@@ -101,7 +101,7 @@ def atualizar(dominio, id_cliente, payload):
 def remover(dominio, id_cliente):
     if not dominio:
         return {"success": False, "message": "Parâmetro 'dominio' é obrigatório"}
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info.get('success'):
@@ -0,0 +1,113 @@
+"""
+Códigos de recuperação de senha (/login/esqueci e /login/redefinir-codigo).
+
+Dois armazéns com a mesma interface, escolhidos por CODIGOS_RESET_BACKEND:
+  - "sqlite" (padrão): arquivo local compartilhado por todos os workers do container;
+  - "memoria": dicionário do processo, só serve com um único worker.
+Os códigos expiram após CODIGOS_RESET_TTL segundos e no máximo CODIGOS_RESET_MAX
+ficam guardados (os mais antigos saem primeiro).
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+CODIGOS_RESET_BACKEND = os.getenv("CODIGOS_RESET_BACKEND", "sqlite")
+CODIGOS_RESET_SQLITE = os.getenv("CODIGOS_RESET_SQLITE", "/tmp/dualm_codigos_reset.sqlite3")
+CODIGOS_RESET_TTL = int(os.getenv("CODIGOS_RESET_TTL", "900"))
+CODIGOS_RESET_MAX = int(os.getenv("CODIGOS_RESET_MAX", "10000"))
+
+
+class ArmazemMemoria:
+    """{chave: (codigo, expira_em)} em ordem de gravação; só vale dentro do processo."""
+
+    def __init__(self, ttl=CODIGOS_RESET_TTL, maximo=CODIGOS_RESET_MAX):
+        self.ttl = ttl
+        self.maximo = maximo
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def salvar(self, chave, codigo):
+        agora = time.time()
+        with self._lock:
+            self._itens.pop(chave, None)
+            self._itens[chave] = (codigo, agora + self.ttl)
+            # TTL único: os primeiros da fila são sempre os que expiram antes
+            while self._itens:
+                _, (_, expira_em) = next(iter(self._itens.items()))
+                if expira_em > agora and len(self._itens) <= self.maximo:
+                    break
+                self._itens.popitem(last=False)
+
+    def obter(self, chave):
+        """{'code', 'expires_at'} (epoch) ou None. Um código expirado ainda é devolvido até ser removido."""
+        with self._lock:
+            item = self._itens.get(chave)
+        if item is None:
+            return None
+        return {"code": item[0], "expires_at": item[1]}
+
+    def remover(self, chave):
+        with self._lock:
+            self._itens.pop(chave, None)
+
+
+class ArmazemSQLite:
+    """Tabela num arquivo SQLite local; uma conexão por thread."""
+
+    def __init__(self, caminho=CODIGOS_RESET_SQLITE, ttl=CODIGOS_RESET_TTL, maximo=CODIGOS_RESET_MAX):
+        self.caminho = caminho
+        self.ttl = ttl
+        self.maximo = maximo
+        self._local = threading.local()
+        with self._conexao() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS codigos_reset ("
+                " chave TEXT PRIMARY KEY, codigo TEXT NOT NULL, expira_em REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS codigos_reset_expira_idx ON codigos_reset (expira_em)")
+
+    def _conexao(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=5)
+            self._local.conn = conn
+        return conn
+
+    def salvar(self, chave, codigo):
+        agora = time.time()
+        with self._conexao() as conn:
+            conn.execute("DELETE FROM codigos_reset WHERE expira_em <= ?", (agora,))
+            conn.execute(
+                "INSERT OR REPLACE INTO codigos_reset (chave, codigo, expira_em) VALUES (?, ?, ?)",
+                (chave, codigo, agora + self.ttl),
+            )
+            conn.execute(
+                "DELETE FROM codigos_reset WHERE chave IN ("
+                " SELECT chave FROM codigos_reset ORDER BY expira_em DESC LIMIT -1 OFFSET ?)",
+                (self.maximo,),
+            )
+
+    def obter(self, chave):
+        """{'code', 'expires_at'} (epoch) ou None. Um código expirado ainda é devolvido até ser removido."""
+        row = self._conexao().execute(
+            "SELECT codigo, expira_em FROM codigos_reset WHERE chave = ?", (chave,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"code": row[0], "expires_at": row[1]}
+
+    def remover(self, chave):
+        with self._conexao() as conn:
+            conn.execute("DELETE FROM codigos_reset WHERE chave = ?", (chave,))
+
+
+def criar_armazem(backend=CODIGOS_RESET_BACKEND):
+    if backend == "memoria":
+        return ArmazemMemoria()
+    if backend == "sqlite":
+        return ArmazemSQLite()
+    raise ValueError(f"CODIGOS_RESET_BACKEND inválido: {backend}")
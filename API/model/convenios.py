@@ -3,7 +3,7 @@ from model.login import busca_ip
 
 
 def listar(dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -26,7 +26,7 @@ def listar(dominio):
 
 
 def criar(dominio, nome_convenio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -54,7 +54,7 @@ def criar(dominio, nome_convenio):
 
 
 def atualizar(dominio, id_convenio, nome_convenio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -78,7 +78,7 @@ def atualizar(dominio, id_convenio, nome_convenio):
 
 
 def excluir(dominio, id_convenio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -1,17 +1,90 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as EsperaEsgotada
+
 import bcrypt
 
+
+# Custo (work factor) dos hashes novos; hashes com outro custo são regravados no login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Quantas verificações de login calcular ao mesmo tempo por processo
+BCRYPT_PARALELO = int(os.getenv("BCRYPT_PARALELO", "2"))
+# Logins admitidos ao mesmo tempo por processo (calculando + na fila); acima disso
+# o login responde 503 na hora em vez de prender uma thread da requisição
+BCRYPT_FILA_MAX = int(os.getenv("BCRYPT_FILA_MAX", "16"))
+# Espera máxima de um login admitido pela sua verificação (segundos)
+BCRYPT_ESPERA_SEGUNDOS = float(os.getenv("BCRYPT_ESPERA_SEGUNDOS", "5"))
+# Threads para hashes novos (cadastro e troca de senha, regravação de custo)
+BCRYPT_PARALELO_HASH = int(os.getenv("BCRYPT_PARALELO_HASH", "1"))
+
+# O bcrypt libera o GIL: as threads dos pools calculam fora do worker da requisição
+# e o limite de threads impede que um pico de logins ocupe toda a CPU. Hashes novos
+# têm pool próprio e não disputam a fila dos logins
+_executor = ThreadPoolExecutor(max_workers=max(1, BCRYPT_PARALELO), thread_name_prefix="bcrypt")
+_executor_hash = ThreadPoolExecutor(max_workers=max(1, BCRYPT_PARALELO_HASH), thread_name_prefix="bcrypt-hash")
+_vagas_login = threading.BoundedSemaphore(max(1, BCRYPT_FILA_MAX))
+
+
+class BcryptOcupado(Exception):
+    """Sem vaga (ou sem resposta a tempo) para verificar a senha: o login responde 503."""
+
+
+def _hash(senha_plana: str) -> str:
+    hash_bytes = bcrypt.hashpw(senha_plana.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+    return hash_bytes.decode('utf-8')
+
+
+def _confere(senha_plana: str, senha_hash: str) -> bool:
+    return bcrypt.checkpw(senha_plana.encode('utf-8'), senha_hash.encode('utf-8'))
+
+
 def camuflar_senha(senha_plana: str) -> str:
     # Gera o hash da senha com um salt automático
-    hash_bytes = bcrypt.hashpw(senha_plana.encode('utf-8'), bcrypt.gensalt())
-    return hash_bytes.decode('utf-8')  # converte para string
+    return _executor_hash.submit(_hash, senha_plana).result()
+
 
 def verificar_senha(senha_plana: str, senha_hash: str) -> bool:
-    # Compara a senha digitada com o hash armazenado
-    return bcrypt.checkpw(senha_plana.encode('utf-8'), senha_hash.encode('utf-8'))
+    """
+    Compara a senha digitada com o hash armazenado. Levanta BcryptOcupado se já
+    houver BCRYPT_FILA_MAX logins admitidos ou se a resposta passar de
+    BCRYPT_ESPERA_SEGUNDOS.
+    """
+    if not _vagas_login.acquire(blocking=False):
+        raise BcryptOcupado()
+    try:
+        futuro = _executor.submit(_confere, senha_plana, senha_hash)
+    except BaseException:
+        _vagas_login.release()
+        raise
+    # A vaga volta quando o cálculo termina (ou é cancelado), não quando a requisição desiste
+    futuro.add_done_callback(lambda _f: _vagas_login.release())
+    try:
+        return futuro.result(timeout=BCRYPT_ESPERA_SEGUNDOS)
+    except EsperaEsgotada:
+        futuro.cancel()
+        raise BcryptOcupado()
+
+
+def custo_hash(senha_hash: str):
+    # "$2b$12$..." -> 12
+    try:
+        return int(senha_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
 
 
+def precisa_rehash(senha_hash: str) -> bool:
+    return custo_hash(senha_hash) != BCRYPT_ROUNDS
 
 
-senha = "admin"
-senha_hash = camuflar_senha(senha)
-print(senha_hash)
\ No newline at end of file
+def regravar_em_segundo_plano(senha_plana: str, gravar):
+    """
+    Calcula no pool o hash com o custo atual e o entrega a `gravar(novo_hash)`,
+    sem bloquear quem chamou.
+    """
+    def _tarefa():
+        try:
+            gravar(_hash(senha_plana))
+        except Exception as e:
+            print(f"Erro ao regravar hash de senha: {e}")
+    return _executor_hash.submit(_tarefa)
@@ -1,22 +1,325 @@
+import atexit
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
+import psycopg2.pool
+from flask import g, has_app_context
 
 
 DB_USER = "dualm"
 DB_PASSWORD = "@p1_Du@l3!@"
 DB_NAME = "dualm"
 
+# Pool de conexões por host de tenant (sobrescrever via variáveis de ambiente)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_IDLE_SECONDS = int(os.getenv("DB_POOL_IDLE_SECONDS", "300"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+# Conexões paradas há mais que isso recebem um SELECT 1 antes de serem entregues
+DB_POOL_PING_SECONDS = int(os.getenv("DB_POOL_PING_SECONDS", "30"))
+
+
+def _abrir_conexao(ip_dominio):
+    return psycopg2.connect(
+        host= ip_dominio,
+        user= DB_USER,
+        password= DB_PASSWORD,
+        dbname= DB_NAME,
+        # libpq aceita só segundos inteiros (mínimo efetivo de 2)
+        connect_timeout=max(2, int(math.ceil(DB_POOL_TIMEOUT_SECONDS))),
+        cursor_factory=psycopg2.extras.RealDictCursor  # cursor retorna dict
+    )
+
+
+def abrir_conexao_dedicada(ip_dominio):
+    """Conexão fora do pool, para usos de longa duração (ex.: migrações). Quem abre fecha."""
+    return _abrir_conexao(ip_dominio)
+
+
+def _fechar_silencioso(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class PoolTenant:
+    """
+    Pool de conexões de um único host de tenant.
+    - mantém no mínimo `minimo` conexões ociosas e nunca mais que `maximo` abertas
+    - valida a conexão na retirada (conexão quebrada é descartada e reaberta)
+    - fecha conexões ociosas há mais de `ocioso_segundos` (acima do mínimo)
+    """
+
+    def __init__(self, host, minimo=DB_POOL_MIN, maximo=DB_POOL_MAX, ocioso_segundos=DB_POOL_IDLE_SECONDS):
+        self.host = host
+        self.minimo = max(0, int(minimo))
+        self.maximo = max(1, int(maximo))
+        self.ocioso_segundos = ocioso_segundos
+        self._livres = []  # pilha de (conn, devolvida_em); a mais recente fica no topo
+        self._abertas = 0
+        self._cond = threading.Condition()
+
+    def _saudavel(self, conn, devolvida_em):
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - devolvida_em < DB_POOL_PING_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _despejar_ociosas(self):
+        # Chamado com o lock adquirido. As mais antigas ficam no início da pilha.
+        agora = time.monotonic()
+        while len(self._livres) > self.minimo:
+            conn, devolvida_em = self._livres[0]
+            if agora - devolvida_em < self.ocioso_segundos:
+                break
+            self._livres.pop(0)
+            self._abertas -= 1
+            _fechar_silencioso(conn)
+
+    def obter(self, timeout=DB_POOL_TIMEOUT_SECONDS):
+        limite = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while True:
+                    self._despejar_ociosas()
+                    if self._livres:
+                        conn, devolvida_em = self._livres.pop()
+                        break
+                    if self._abertas < self.maximo:
+                        self._abertas += 1
+                        conn = None
+                        break
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise psycopg2.pool.PoolError(f"Limite de {self.maximo} conexões atingido para '{self.host}'")
+                    self._cond.wait(restante)
+            if conn is None:
+                break
+            # Checagem (pode fazer SELECT 1) fora do lock: uma conexão travada não segura os demais
+            if self._saudavel(conn, devolvida_em):
+                return conn
+            _fechar_silencioso(conn)
+            with self._cond:
+                self._abertas -= 1
+                self._cond.notify()
+
+        # Abre fora do lock para não bloquear quem só quer devolver conexões
+        try:
+            return _abrir_conexao(self.host)
+        except Exception:
+            with self._cond:
+                self._abertas -= 1
+                self._cond.notify()
+            raise
+
+    def devolver(self, conn):
+        reutilizavel = not conn.closed
+        if reutilizavel:
+            try:
+                # Nunca devolve ao pool uma transação aberta ou abortada
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                reutilizavel = False
+        with self._cond:
+            if reutilizavel:
+                self._livres.append((conn, time.monotonic()))
+            else:
+                self._abertas -= 1
+                _fechar_silencioso(conn)
+            self._despejar_ociosas()
+            self._cond.notify()
+
+    def fechar(self):
+        with self._cond:
+            for conn, _ in self._livres:
+                self._abertas -= 1
+                _fechar_silencioso(conn)
+            self._livres = []
+            self._cond.notify_all()
+
+
+class ConexaoPool:
+    """
+    Conexão emprestada de um PoolTenant. Repassa tudo para a conexão psycopg2,
+    mas `close()` devolve ao pool em vez de encerrar a sessão. Se o chamador
+    esquecer de fechar, a devolução acontece quando o objeto é coletado.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self.host = pool.host
+
+    def __getattr__(self, nome):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(conn, nome)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.devolver(conn)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+
+def _pool_do_host(ip_dominio):
+    global _pools, _pools_pid
+    with _pools_lock:
+        # Após fork (ex.: gunicorn), conexões herdadas do processo pai não podem ser usadas
+        if _pools_pid != os.getpid():
+            _pools = {}
+            _pools_pid = os.getpid()
+        pool = _pools.get(ip_dominio)
+        if pool is None:
+            pool = PoolTenant(ip_dominio)
+            _pools[ip_dominio] = pool
+        return pool
+
+
+def fechar_pools():
+    """Encerra as conexões livres de todos os pools do processo (registrado no atexit)."""
+    with _pools_lock:
+        # Pools herdados de outro processo (antes do fork) não são deste: encerrá-los
+        # aqui derrubaria as sessões do processo pai
+        if _pools_pid != os.getpid():
+            return
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.fechar()
+
+
+# Ao sair (fim do worker do gunicorn, fim do python -m model.migracoes) as sessões
+# livres são encerradas com Terminate em vez de cair por timeout no servidor
+atexit.register(fechar_pools)
+
+
+class ConexaoCompartilhada:
+    """
+    Visão da conexão de uma transacao_requisicao entregue aos helpers dos models.
+    `commit()` e `close()` viram no-op: quem confirma e devolve a conexão é o
+    bloco que abriu a transação, uma única vez ao final.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.host = conn.host
+
+    def __getattr__(self, nome):
+        return getattr(self._conn, nome)
+
+    @property
+    def closed(self):
+        return self._conn.closed
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_transacoes_locais = threading.local()
+
+
+def _transacoes_abertas():
+    # Dentro de uma requisição Flask o registro vive em `g`; fora dela (scripts), por thread
+    if has_app_context():
+        if "transacoes_tenant" not in g:
+            g.transacoes_tenant = {}
+        return g.transacoes_tenant
+    if not hasattr(_transacoes_locais, "abertas"):
+        _transacoes_locais.abertas = {}
+    return _transacoes_locais.abertas
+
+
+@contextmanager
+def transacao_requisicao(ip_dominio):
+    """
+    Abre uma conexão/transação para o host e a compartilha com toda chamada a
+    `conexao(ip_dominio)` feita dentro do bloco. Ao sair, faz um único commit
+    (ou rollback, se houver exceção) e devolve a conexão ao pool. Blocos
+    aninhados para o mesmo host reaproveitam a transação externa.
+    """
+    abertas = _transacoes_abertas()
+    if ip_dominio in abertas:
+        yield abertas[ip_dominio]
+        return
+
+    with obter_conexao(ip_dominio) as conn:
+        compartilhada = ConexaoCompartilhada(conn)
+        abertas[ip_dominio] = compartilhada
+        try:
+            yield compartilhada
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            abertas.pop(ip_dominio, None)
+
+
+@contextmanager
+def obter_conexao(ip_dominio):
+    """
+    Empresta uma conexão do pool do host e a devolve ao sair do bloco:
+
+        with obter_conexao(ip) as conn:
+            ...
+
+    Falhas de conexão sobem como psycopg2.Error.
+    """
+    pool = _pool_do_host(ip_dominio)
+    conn = ConexaoPool(pool, pool.obter())
+    try:
+        yield conn
+    finally:
+        conn.close()
+
 
 def conexao(ip_dominio):
+    compartilhada = _transacoes_abertas().get(ip_dominio)
+    if compartilhada is not None:
+        return {"success": True, "connection": compartilhada}
     try:
-        connection = psycopg2.connect(
-            host= ip_dominio,
-            user= DB_USER,
-            password= DB_PASSWORD,
-            dbname= DB_NAME,
-            cursor_factory=psycopg2.extras.RealDictCursor  # cursor retorna dict
-        )
+        pool = _pool_do_host(ip_dominio)
+        connection = ConexaoPool(pool, pool.obter())
         return {"success": True, "connection": connection}
+    except psycopg2.pool.PoolError as e:
+        print(f"Pool esgotado para o banco '{ip_dominio}': {e}")
+        return {"success": False, "message": f"Banco '{ip_dominio}' indisponível no momento, tente novamente"}
     except psycopg2.Error as e:
         print(f"Erro na conexão com o banco '{ip_dominio}': {e}")
         return {"success": False, "message": f"Dominio '{ip_dominio}' não encontrado"}
@@ -25,7 +328,7 @@ def conexao(ip_dominio):
 if __name__ == "__main__":
     # Testando a conexão
     resultado = conexao("69.62.99.17")  # ou outro host se quiser trocar dinamicamente
-    
+
     if resultado["success"]:
         conn = resultado["connection"]
         try:
@@ -38,4 +341,4 @@ if __name__ == "__main__":
         finally:
             conn.close()
     else:
-        print("Falha:", resultado["message"])
\ No newline at end of file
+        print("Falha:", resultado["message"])
@@ -1,40 +1,11 @@
 from model.db_config import conexao
 from model.login import busca_ip
+from model.schema import tem_coluna, tem_tabela
 from model.criptografia import camuflar_senha
 
 
-def _has_column(conn, table_name, column_name):
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1
-                FROM information_schema.columns
-                WHERE table_name = %s AND column_name = %s
-                LIMIT 1
-                """,
-                (table_name, column_name),
-            )
-            return cur.fetchone() is not None
-    except Exception:
-        return False
-
-def _has_table(conn, table_name):
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1 FROM information_schema.tables WHERE table_name = %s LIMIT 1
-                """,
-                (table_name,),
-            )
-            return cur.fetchone() is not None
-    except Exception:
-        return False
-
-
 def obter(dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info["success"]:
@@ -42,7 +13,7 @@ def obter(dominio):
     conn = info["connection"]
     cur = conn.cursor()
     try:
-        has_dispara = _has_column(conn, 'empresa', 'dispara_msg')
+        has_dispara = tem_coluna(conn, 'empresa', 'dispara_msg')
         if has_dispara:
             cur.execute("SELECT id_empresa, nome_empresa, descricao_empresa, horario_atendimento, telefone, endereco, dispara_msg FROM empresa LIMIT 1")
         else:
@@ -59,7 +30,7 @@ def obter(dominio):
             except Exception:
                 pass
         # obter antecedencia da tabela dispara_msg, se existir
-        if _has_table(conn, 'dispara_msg'):
+        if tem_tabela(conn, 'dispara_msg'):
             try:
                 cur.execute("SELECT antecedencia FROM dispara_msg ORDER BY antecedencia ASC")
                 msg_rows = cur.fetchall() or []
@@ -88,7 +59,7 @@ def obter(dominio):
 
 
 def atualizar(dominio, payload):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     info = conexao(alvo)
     if not info["success"]:
@@ -106,7 +77,7 @@ def atualizar(dominio, payload):
     try:
         cur.execute("SELECT id_empresa FROM empresa LIMIT 1")
         row = cur.fetchone()
-        has_dispara = _has_column(conn, 'empresa', 'dispara_msg')
+        has_dispara = tem_coluna(conn, 'empresa', 'dispara_msg')
         if row:
             if has_dispara:
                 cur.execute(
@@ -130,7 +101,7 @@ def atualizar(dominio, payload):
                     (nome, descricao, horario, telefone, endereco),
                 )
         # Atualizar/Inserir antecedencia em dispara_msg, se tabela existir e valor fornecido
-        if _has_table(conn, 'dispara_msg') and ((antecedencia is not None) or (antecedencias is not None)):
+        if tem_tabela(conn, 'dispara_msg') and ((antecedencia is not None) or (antecedencias is not None)):
             try:
                 # normaliza para lista de inteiros únicos e ordenados
                 vals = []
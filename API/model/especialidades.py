@@ -3,7 +3,7 @@ from model.login import busca_ip
 
 
 def listar(dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -26,7 +26,7 @@ def listar(dominio):
 
 
 def criar(dominio, nome_especialidade):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -61,7 +61,7 @@ def criar(dominio, nome_especialidade):
 
 
 def atualizar(dominio, id_especialidade, nome_especialidade):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -91,7 +91,7 @@ def atualizar(dominio, id_especialidade, nome_especialidade):
 
 
 def excluir(dominio, id_especialidade):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -1,7 +1,7 @@
 from model.db_config import conexao
 from model.login import busca_ip
-import logging
-import traceback
+from model.grade_horaria import invalidar_grade
+from model.schema import dialeto
 
 
 LIST_COLUMNS = (
@@ -11,7 +11,7 @@ LIST_COLUMNS = (
 
 def listar(dominio):
     # Aceita domínio amigável e resolve para IP do tenant
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -35,7 +35,7 @@ def listar(dominio):
 
 def obter_por_id(dominio, id_especialista):
     # Resolve domínio para IP se necessário
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -63,7 +63,7 @@ def obter_por_id(dominio, id_especialista):
 
 
 def criar(dominio, payload):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -85,87 +85,30 @@ def criar(dominio, payload):
     conn = conn_info["connection"]
     cur = conn.cursor()
     try:
-        # Tenta inserir com id_especialidade se a coluna existir
-        try:
-            # Tentativa 1: com cor e id_especialidade
-            cur.execute(
-                """
-                INSERT INTO especialistas
-                    (nome_especialista, descricao, horario_atendimento, valor_consulta, aceita_convenio, tempo_consulta, gerenciar_agenda, cor, id_especialidade)
-                VALUES
-                    (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id_especialista
-                """,
-                (
-                    nome,
-                    descricao,
-                    horario_atendimento,
-                    valor_consulta,
-                    aceita_convenio,
-                    tempo_consulta,
-                    gerenciar_agenda,
-                    payload.get("cor"),
-                    id_especialidade,
-                ),
-            )
-        except Exception as e1:
-            logging.error("Erro ao inserir especialista (com cor e id_especialidade): %s", str(e1))
-            try:
-                logging.error("Traceback: %s", traceback.format_exc())
-            except Exception:
-                pass
-            # Após erro, limpa o estado da transação antes da próxima tentativa
-            conn.rollback()
-            try:
-                # Tentativa 2: com cor, sem id_especialidade
-                cur.execute(
-                    """
-                    INSERT INTO especialistas
-                        (nome_especialista, descricao, horario_atendimento, valor_consulta, aceita_convenio, tempo_consulta, gerenciar_agenda, cor)
-                    VALUES
-                        (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id_especialista
-                    """,
-                    (
-                        nome,
-                        descricao,
-                        horario_atendimento,
-                        valor_consulta,
-                        aceita_convenio,
-                        tempo_consulta,
-                        gerenciar_agenda,
-                        payload.get("cor") or None,
-                    ),
-                )
-            except Exception as e2:
-                logging.error("Erro ao inserir especialista (com cor, sem id_especialidade): %s", str(e2))
-                try:
-                    logging.error("Traceback: %s", traceback.format_exc())
-                except Exception:
-                    pass
-                conn.rollback()
-                # Tentativa 3: sem cor e sem id_especialidade (para bancos desatualizados)
-                cur.execute(
-                    """
-                    INSERT INTO especialistas
-                        (nome_especialista, descricao, horario_atendimento, valor_consulta, aceita_convenio, tempo_consulta, gerenciar_agenda)
-                    VALUES
-                        (%s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id_especialista
-                    """,
-                    (
-                        nome,
-                        descricao,
-                        horario_atendimento,
-                        valor_consulta,
-                        aceita_convenio,
-                        tempo_consulta,
-                        gerenciar_agenda,
-                    ),
-                )
+        # cor e id_especialidade fazem parte do schema canônico (model/migracoes.py)
+        cur.execute(
+            """
+            INSERT INTO especialistas
+                (nome_especialista, descricao, horario_atendimento, valor_consulta, aceita_convenio, tempo_consulta, gerenciar_agenda, cor, id_especialidade)
+            VALUES
+                (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING id_especialista
+            """,
+            (
+                nome,
+                descricao,
+                horario_atendimento,
+                valor_consulta,
+                aceita_convenio,
+                tempo_consulta,
+                gerenciar_agenda,
+                payload.get("cor") or None,
+                id_especialidade,
+            ),
+        )
         row = cur.fetchone()
         conn.commit()
-        return {"success": True, "data": {"id_especialista": row["id_especialista"] if isinstance(row, dict) else row[0]}}
+        return {"success": True, "data": {"id_especialista": row["id_especialista"]}}
     except Exception as e:
         conn.rollback()
         return {"success": False, "message": f"Erro ao criar especialista: {e}"}
@@ -178,7 +121,7 @@ def criar(dominio, payload):
 
 
 def atualizar(dominio, id_especialista, payload):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -206,24 +149,22 @@ def atualizar(dominio, id_especialista, payload):
             (*valores, id_especialista),
         )
         conn.commit()
+        # A grade compilada em cache deixa de valer com o novo horario_atendimento
+        invalidar_grade(alvo, id_especialista)
 
         # Se foi marcado como NÃO aceitar convênio, apagar vínculos existentes
         aceita_conv_flag = payload.get("aceita_convenio")
         if aceita_conv_flag is False:
             try:
-                for tabela in ("especialista_convenios", "especialistas_convenios"):
-                    try:
-                        cur.execute(
-                            f"DELETE FROM {tabela} WHERE id_especialista = %s",
-                            (id_especialista,),
-                        )
-                        conn.commit()
-                    except Exception:
-                        conn.rollback()
-                        continue
+                tabela = dialeto(conn).tabela_especialista_convenios
+                cur.execute(
+                    f"DELETE FROM {tabela} WHERE id_especialista = %s",
+                    (id_especialista,),
+                )
+                conn.commit()
             except Exception:
                 # Não bloqueia a atualização se a limpeza falhar
-                pass
+                conn.rollback()
 
         return {"success": True}
     except Exception as e:
@@ -238,7 +179,7 @@ def atualizar(dominio, id_especialista, payload):
 
 
 def listar_especialidades_do_especialista(dominio, id_especialista):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -270,7 +211,7 @@ def listar_especialidades_do_especialista(dominio, id_especialista):
 
 
 def adicionar_especialidade(dominio, id_especialista, id_especialidade):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -301,7 +242,7 @@ def adicionar_especialidade(dominio, id_especialista, id_especialidade):
 
 
 def remover_especialidade(dominio, id_especialista, id_especialidade):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -328,7 +269,7 @@ def remover_especialidade(dominio, id_especialista, id_especialidade):
 
 
 def excluir(dominio, id_especialista):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -342,6 +283,7 @@ def excluir(dominio, id_especialista):
         # Remove o especialista
         cur.execute("DELETE FROM especialistas WHERE id_especialista = %s", (id_especialista,))
         conn.commit()
+        invalidar_grade(alvo, id_especialista)
         return {"success": True}
     except Exception as e:
         conn.rollback()
@@ -356,7 +298,7 @@ def excluir(dominio, id_especialista):
 
 # --- Convênios do especialista (N:N) ---
 def listar_convenios_do_especialista(dominio, id_especialista):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -365,25 +307,19 @@ def listar_convenios_do_especialista(dominio, id_especialista):
     conn = conn_info["connection"]
     cur = conn.cursor()
     try:
-        # tenta tabela no singular e plural
-        for tabela in ("especialista_convenios", "especialistas_convenios"):
-            try:
-                cur.execute(
-                    f"""
-                    SELECT ec.id_convenio, c.nome_convenio
-                    FROM {tabela} ec
-                    JOIN convenios c ON c.id_convenio = ec.id_convenio
-                    WHERE ec.id_especialista = %s
-                    ORDER BY c.nome_convenio ASC
-                    """,
-                    (id_especialista,),
-                )
-                rows = cur.fetchall()
-                if rows is not None:
-                    return {"success": True, "data": rows}
-            except Exception:
-                continue
-        return {"success": True, "data": []}
+        # Nome da tabela de vínculo (singular/plural) resolvido pelo dialeto do tenant
+        tabela = dialeto(conn).tabela_especialista_convenios
+        cur.execute(
+            f"""
+            SELECT ec.id_convenio, c.nome_convenio
+            FROM {tabela} ec
+            JOIN convenios c ON c.id_convenio = ec.id_convenio
+            WHERE ec.id_especialista = %s
+            ORDER BY c.nome_convenio ASC
+            """,
+            (id_especialista,),
+        )
+        return {"success": True, "data": cur.fetchall()}
     except Exception as e:
         return {"success": False, "message": f"Erro ao listar convênios do especialista: {e}"}
     finally:
@@ -395,7 +331,7 @@ def listar_convenios_do_especialista(dominio, id_especialista):
 
 
 def adicionar_convenio(dominio, id_especialista, id_convenio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -404,18 +340,13 @@ def adicionar_convenio(dominio, id_especialista, id_convenio):
     conn = conn_info["connection"]
     cur = conn.cursor()
     try:
-        for tabela in ("especialista_convenios", "especialistas_convenios"):
-            try:
-                cur.execute(
-                    f"INSERT INTO {tabela} (id_especialista, id_convenio) VALUES (%s, %s) ON CONFLICT DO NOTHING",
-                    (id_especialista, id_convenio),
-                )
-                conn.commit()
-                return {"success": True}
-            except Exception:
-                conn.rollback()
-                continue
-        return {"success": False, "message": "Tabela de vínculo de convênios não encontrada"}
+        tabela = dialeto(conn).tabela_especialista_convenios
+        cur.execute(
+            f"INSERT INTO {tabela} (id_especialista, id_convenio) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+            (id_especialista, id_convenio),
+        )
+        conn.commit()
+        return {"success": True}
     except Exception as e:
         conn.rollback()
         return {"success": False, "message": f"Erro ao vincular convênio: {e}"}
@@ -428,7 +359,7 @@ def adicionar_convenio(dominio, id_especialista, id_convenio):
 
 
 def remover_convenio(dominio, id_especialista, id_convenio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     conn_info = conexao(alvo)
     if not conn_info["success"]:
@@ -437,18 +368,13 @@ def remover_convenio(dominio, id_especialista, id_convenio):
     conn = conn_info["connection"]
     cur = conn.cursor()
     try:
-        for tabela in ("especialista_convenios", "especialistas_convenios"):
-            try:
-                cur.execute(
-                    f"DELETE FROM {tabela} WHERE id_especialista = %s AND id_convenio = %s",
-                    (id_especialista, id_convenio),
-                )
-                conn.commit()
-                return {"success": True}
-            except Exception:
-                conn.rollback()
-                continue
-        return {"success": False, "message": "Tabela de vínculo de convênios não encontrada"}
+        tabela = dialeto(conn).tabela_especialista_convenios
+        cur.execute(
+            f"DELETE FROM {tabela} WHERE id_especialista = %s AND id_convenio = %s",
+            (id_especialista, id_convenio),
+        )
+        conn.commit()
+        return {"success": True}
     except Exception as e:
         conn.rollback()
         return {"success": False, "message": f"Erro ao desvincular convênio: {e}"}
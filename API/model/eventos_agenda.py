@@ -0,0 +1,244 @@
+"""
+Serviço de eventos da agenda (Server-Sent Events), num processo próprio:
+
+    python -m model.eventos_agenda
+
+Roda em asyncio, fora do gunicorn: cada navegador conectado é uma corrotina, não
+uma thread de worker. Cada banco de tenant tem uma única conexão LISTEN, lida
+pelo próprio loop, que repassa cada NOTIFY do trigger da agenda (migração 8) a
+todos os navegadores daquele tenant. O navegador pede à API um ticket de uso
+único (POST /agendamentos/eventos/ticket), abre GET /eventos?ticket=... aqui e, a
+cada evento, busca /agendamentos/changes na API com o token normal.
+"""
+import asyncio
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2.extensions
+
+from model.auth import SSE_TICKET_TTL, verificar_ticket_eventos
+from model.db_config import abrir_conexao_dedicada
+from model.login import host_do_tenant
+
+
+# Canal do NOTIFY disparado pelo trigger agendamento_registrar_alteracao
+CANAL_AGENDA = "agenda_alteracoes"
+
+# Porta HTTP do serviço
+SSE_PORTA = int(os.getenv("SSE_PORTA", "5001"))
+# Eventos pendentes por navegador; com a fila cheia os novos são descartados (o
+# navegador já vai buscar /agendamentos/changes, que traz tudo desde o seu cursor)
+SSE_FILA_MAX = int(os.getenv("SSE_FILA_MAX", "100"))
+# Comentário enviado sem eventos, para manter proxies abertos e notar quem saiu (segundos)
+SSE_PING_SEGUNDOS = float(os.getenv("SSE_PING_SEGUNDOS", "15"))
+
+# Avisa os navegadores que eventos podem ter se perdido (ouvinte reconectado)
+_EVENTO_RESSINCRONIZAR = '{"operacao": "ressincronizar"}'
+
+
+def _fechar_conexao_pendente(tentativa):
+    if not tentativa.cancelled() and tentativa.exception() is None:
+        tentativa.result().close()
+
+
+class OuvinteTenant:
+    """
+    A conexão LISTEN de um host de tenant, lida pelo loop via add_reader. Cada
+    NOTIFY vai para a fila de todos os navegadores inscritos. Reconecta com
+    espera progressiva e é encerrado quando sai o último inscrito.
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.filas = set()
+        self.tarefa = None
+
+    def _conectar(self):
+        conn = abrir_conexao_dedicada(self.host)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute(f"LISTEN {CANAL_AGENDA}")
+        return conn
+
+    def distribuir(self, payload):
+        for fila in list(self.filas):
+            try:
+                fila.put_nowait(payload)
+            except asyncio.QueueFull:
+                pass
+
+    def _ler(self, conn, caiu):
+        try:
+            conn.poll()
+        except Exception as e:
+            if not caiu.done():
+                caiu.set_result(e)
+            return
+        while conn.notifies:
+            self.distribuir(conn.notifies.pop(0).payload)
+
+    async def manter(self):
+        loop = asyncio.get_running_loop()
+        espera = 1
+        reconexao = False
+        while True:
+            # Conectar bloqueia (libpq): vai para o executor padrão
+            tentativa = loop.run_in_executor(None, self._conectar)
+            try:
+                conn = await asyncio.shield(tentativa)
+            except asyncio.CancelledError:
+                # Saiu o último navegador no meio da conexão: fecha a que ainda vai chegar
+                tentativa.add_done_callback(_fechar_conexao_pendente)
+                raise
+            except Exception as e:
+                print(f"Ouvinte da agenda em '{self.host}' sem conexão: {e}")
+                await asyncio.sleep(espera)
+                espera = min(espera * 2, 30)
+                reconexao = True
+                continue
+            espera = 1
+            caiu = loop.create_future()
+            # Guardado antes: depois da queda o psycopg2 não devolve mais o fileno
+            descritor = conn.fileno()
+            loop.add_reader(descritor, self._ler, conn, caiu)
+            try:
+                if reconexao:
+                    self.distribuir(_EVENTO_RESSINCRONIZAR)
+                erro = await caiu
+                print(f"Ouvinte da agenda em '{self.host}' caiu: {erro}")
+                reconexao = True
+            finally:
+                loop.remove_reader(descritor)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+_ouvintes = {}
+
+
+def assinar(host):
+    """Inscreve um navegador nos eventos do tenant. Retorna a fila de payloads (JSON em str)."""
+    fila = asyncio.Queue(maxsize=SSE_FILA_MAX)
+    ouvinte = _ouvintes.get(host)
+    if ouvinte is None:
+        ouvinte = OuvinteTenant(host)
+        ouvinte.tarefa = asyncio.get_running_loop().create_task(ouvinte.manter())
+        _ouvintes[host] = ouvinte
+    ouvinte.filas.add(fila)
+    return fila
+
+
+def cancelar(host, fila):
+    ouvinte = _ouvintes.get(host)
+    if ouvinte is None:
+        return
+    ouvinte.filas.discard(fila)
+    if not ouvinte.filas:
+        # Último navegador do tenant: encerra a conexão LISTEN
+        del _ouvintes[host]
+        ouvinte.tarefa.cancel()
+
+
+# nonce -> expiração (monotonic) dos tickets já usados neste processo
+_tickets_usados = {}
+
+
+def _consumir_ticket(ticket):
+    """Tenant do ticket, se válido e ainda não usado; None caso contrário."""
+    if not ticket:
+        return None
+    ok, dados, _ = verificar_ticket_eventos(ticket)
+    if not ok:
+        return None
+    agora = time.monotonic()
+    for nonce in [n for n, expira in _tickets_usados.items() if expira <= agora]:
+        del _tickets_usados[nonce]
+    if dados["nonce"] in _tickets_usados:
+        return None
+    _tickets_usados[dados["nonce"]] = agora + SSE_TICKET_TTL
+    return dados["tenant"]
+
+
+def _resposta(writer, status, mensagem):
+    corpo = mensagem.encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        "Content-Type: text/plain; charset=utf-8\r\n"
+        "Access-Control-Allow-Origin: *\r\n"
+        f"Content-Length: {len(corpo)}\r\n"
+        "Connection: close\r\n\r\n".encode("latin-1") + corpo
+    )
+
+
+async def _ler_requisicao(reader):
+    """(método, caminho, query) da requisição; os cabeçalhos são lidos e ignorados."""
+    linha = (await reader.readline()).decode("latin-1").split()
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+    if len(linha) != 3:
+        return None, None, {}
+    url = urlsplit(linha[1])
+    return linha[0], url.path, parse_qs(url.query)
+
+
+async def _atender(reader, writer):
+    host = fila = None
+    try:
+        try:
+            metodo, caminho, query = await asyncio.wait_for(_ler_requisicao(reader), timeout=10)
+        except (asyncio.TimeoutError, ValueError):
+            return
+        if metodo != "GET" or caminho != "/eventos":
+            _resposta(writer, "404 Not Found", "Não encontrado")
+            return
+        tenant = _consumir_ticket((query.get("ticket") or [None])[0])
+        if tenant is None:
+            _resposta(writer, "401 Unauthorized", "Ticket inválido")
+            return
+        host = await asyncio.get_running_loop().run_in_executor(None, host_do_tenant, tenant)
+        if not host:
+            _resposta(writer, "503 Service Unavailable", "Domínio indisponível")
+            return
+
+        fila = assinar(host)
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Access-Control-Allow-Origin: *\r\n"
+            b"X-Accel-Buffering: no\r\n"
+            b"Connection: keep-alive\r\n\r\n"
+            b": conectado\n\n"
+        )
+        await writer.drain()
+        while True:
+            try:
+                payload = await asyncio.wait_for(fila.get(), timeout=SSE_PING_SEGUNDOS)
+                writer.write(f"event: agenda\ndata: {payload}\n\n".encode("utf-8"))
+            except asyncio.TimeoutError:
+                writer.write(b": ping\n\n")
+            # Navegador que saiu aparece aqui como erro de escrita
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        if fila is not None:
+            cancelar(host, fila)
+        try:
+            writer.close()
+        except Exception:
+            pass
+
+
+async def servir(porta=SSE_PORTA):
+    servidor = await asyncio.start_server(_atender, "0.0.0.0", porta)
+    print(f"Eventos da agenda em :{porta}/eventos")
+    async with servidor:
+        await servidor.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(servir())
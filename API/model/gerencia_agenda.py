@@ -3,7 +3,7 @@ from model.login import busca_ip
 
 
 def _conn(dominio):
-    ip = busca_ip(dominio) if dominio else None
+    ip = busca_ip(dominio)
     alvo = ip or dominio
     return conexao(alvo)
 
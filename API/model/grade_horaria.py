@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time as _relogio
+from datetime import datetime, time
+
+
+# Janelas usadas quando o especialista não tem horario_atendimento válido (minutos do dia)
+_JANELAS_PADRAO = ((8 * 60, 12 * 60), (13 * 60 + 30, 17 * 60 + 30))
+
+# Por quanto tempo (segundos) a grade em cache vale sem reler o banco. O worker que
+# altera o especialista invalida na hora; os demais enxergam a mudança em até este tempo
+GRADE_CACHE_TTL = int(os.getenv("GRADE_CACHE_TTL", "60"))
+
+_CHAVES_DIA = {
+    0: ("seg", "segunda"),
+    1: ("ter", "terca", "terça"),
+    2: ("qua", "quarta"),
+    3: ("qui", "quinta"),
+    4: ("sex", "sexta"),
+    5: ("sab", "sabado", "sábado"),
+    6: ("dom", "domingo"),
+}
+
+# Grade compilada por (host do tenant, id_especialista):
+# {chave: (grade, horario_atendimento de origem, expira_em)}
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _chave(host, id_especialista):
+    # ids podem chegar como str (payload JSON) ou int (rota)
+    try:
+        return (host, int(id_especialista))
+    except (TypeError, ValueError):
+        return (host, id_especialista)
+
+
+def _minutos(hhmm):
+    t = datetime.strptime(hhmm, "%H:%M").time()
+    return t.hour * 60 + t.minute
+
+
+def _hora(minutos):
+    return time(minutos // 60, minutos % 60)
+
+
+class GradeHoraria:
+    """
+    horario_atendimento de um especialista já interpretado: para cada dia da
+    semana (0=segunda), uma tupla de janelas (inicio, fim) em minutos do dia.
+    """
+
+    __slots__ = ("por_dia",)
+
+    def __init__(self, por_dia):
+        self.por_dia = por_dia
+
+    def janelas(self, data_referencia=None):
+        """Janelas do dia como lista de (time, time), no formato dos helpers de slots."""
+        dia_idx = (data_referencia.weekday() if isinstance(data_referencia, datetime) else datetime.now().weekday())
+        return [(_hora(ini), _hora(fim)) for ini, fim in self.por_dia[dia_idx]]
+
+    def atende(self, data_dt, inicio, duracao_min):
+        """True se [inicio, inicio + duração] cabe inteiro em alguma janela do dia."""
+        ini = inicio.hour * 60 + inicio.minute
+        fim = ini + int(duracao_min or 0)
+        return any(ini >= j_ini and fim <= j_fim for j_ini, j_fim in self.por_dia[data_dt.weekday()])
+
+
+def compilar_grade(raw):
+    """
+    Interpreta a coluna horario_atendimento. Suporta dois formatos:
+    - Lista simples: [{"inicio":"08:00","fim":"12:00"}, ...] (vale para todos os dias)
+    - Mapa por dia: {seg:[{...}], ter:[{...}], ...}
+    Valores ausentes ou inválidos caem nas janelas padrão.
+    """
+    padrao = GradeHoraria((_JANELAS_PADRAO,) * 7)
+    if not raw:
+        # fallback se não houver nada configurado
+        return padrao
+
+    try:
+        # Converte JSON para Python
+        horarios = json.loads(raw) if isinstance(raw, str) else raw
+
+        # Caso 1: lista simples
+        if isinstance(horarios, list):
+            janelas = tuple((_minutos(h["inicio"]), _minutos(h["fim"])) for h in horarios)
+            return GradeHoraria((janelas,) * 7)
+
+        # Caso 2: mapa por dia
+        if isinstance(horarios, dict):
+            por_dia = []
+            for dia_idx in range(7):
+                blocos = []
+                for k in _CHAVES_DIA[dia_idx]:
+                    v = horarios.get(k)
+                    if v:
+                        blocos = v
+                        break
+                try:
+                    janelas = tuple(
+                        (_minutos(h.get("inicio", "08:00")), _minutos(h.get("fim", "17:00")))
+                        for h in blocos or []
+                    )
+                except Exception as e:
+                    print("Erro ao parsear horario_atendimento:", e)
+                    janelas = ()
+                # fallback se o dia não tiver janelas
+                por_dia.append(janelas or _JANELAS_PADRAO)
+            return GradeHoraria(tuple(por_dia))
+
+        # Qualquer outro tipo: fallback
+        return padrao
+    except Exception as e:
+        print("Erro ao parsear horario_atendimento:", e)
+        return padrao
+
+
+def obter_grade(conn, id_especialista):
+    """
+    Grade compilada do especialista: dentro de GRADE_CACHE_TTL sai da memória,
+    sem ida ao banco; depois disso (ou após invalidar_grade) é relida e recompilada.
+    """
+    host = getattr(conn, "host", None)
+    with _cache_lock:
+        item = _cache.get(_chave(host, id_especialista))
+    if item is not None and item[2] > _relogio.monotonic():
+        return item[0]
+
+    cur = conn.cursor()
+    cur.execute("SELECT horario_atendimento FROM especialistas WHERE id_especialista = %s", (id_especialista,))
+    row = cur.fetchone()
+    cur.close()
+    return registrar_grade(host, id_especialista, row.get("horario_atendimento") if row else None)
+
+
+def registrar_grade(host, id_especialista, raw):
+    """
+    Grade de um horario_atendimento já lido por outra consulta (ex.: a validação
+    do agendamento), que renova o cache. Texto igual ao guardado reaproveita a
+    grade compilada.
+    """
+    chave = _chave(host, id_especialista)
+    with _cache_lock:
+        item = _cache.get(chave)
+    grade = item[0] if item is not None and item[1] == raw else compilar_grade(raw)
+    if host is not None:
+        with _cache_lock:
+            _cache[chave] = (grade, raw, _relogio.monotonic() + GRADE_CACHE_TTL)
+    return grade
+
+
+def invalidar_grade(host, id_especialista=None):
+    """Descarta a grade de um especialista do tenant (ou de todos, sem id)."""
+    with _cache_lock:
+        if id_especialista is not None:
+            _cache.pop(_chave(host, id_especialista), None)
+        else:
+            for chave in [c for c in _cache if c[0] == host]:
+                _cache.pop(chave, None)
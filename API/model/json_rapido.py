@@ -0,0 +1,39 @@
+import json
+from datetime import date, time
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional: sem ele cai no json da biblioteca padrão
+    orjson = None
+
+
+def _padrao(obj):
+    # Datas e horários sempre em ISO (o provider padrão do Flask usaria o formato HTTP)
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+
+def dumps(obj):
+    """Serializa para str usando orjson quando disponível."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_padrao, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, default=_padrao, ensure_ascii=False)
+
+
+class JSONProviderRapido(DefaultJSONProvider):
+    """
+    Provider de JSON da aplicação: `jsonify` passa a usar orjson (datas,
+    horários, dicts do RealDictCursor nativos). Parâmetros de formatação como
+    indent/sort_keys não são usados pela API, então são ignorados.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
@@ -1,66 +1,237 @@
-from model.db_config import conexao
-from model.criptografia import camuflar_senha, verificar_senha
+import os
+import threading
+import time
+
+from flask import g, has_request_context
+
+from model.db_config import conexao, obter_conexao
+from model.criptografia import BcryptOcupado, precisa_rehash, regravar_em_segundo_plano, verificar_senha
+from model.schema import tem_coluna
+
+
+IP_CENTRAL = os.getenv("DB_CENTRAL_HOST") or "69.62.99.17"
+
+# Cache de domínio digitado -> tenant: {dominio: (ip ou None, dominio cadastrado, expira_em)}
+TENANT_CACHE_TTL = int(os.getenv("TENANT_CACHE_TTL", "300"))
+TENANT_CACHE_NEGATIVE_TTL = int(os.getenv("TENANT_CACHE_NEGATIVE_TTL", "30"))
+TENANT_CACHE_MAX = 10000
+_cache_tenants = {}
+_cache_tenants_lock = threading.Lock()
+
+# Diretório completo dominio -> IP (empresas_clientes) para os tokens: lido
+# inteiro e recarregado em segundo plano a cada TENANT_DIRETORIO_TTL segundos
+TENANT_DIRETORIO_TTL = int(os.getenv("TENANT_DIRETORIO_TTL", "300"))
+_diretorio = {}
+_diretorio_proxima = None
+_diretorio_lock = threading.Lock()
+
+
+# Colunas de usuarios devolvidas no login (as que existirem no tenant), além do hash.
+# Inclui os nomes alternativos (id, idusuario, nome) usados por tenants mais antigos
+_COLUNAS_LOGIN = (
+    "id_usuario", "id", "idusuario", "nome_usuario", "nome",
+    "email", "id_nivel", "nivel", "id_especialista", "tema",
+)
+
 
 def login(dominio, email, senha):
-    ip = busca_ip(dominio)
+    """
+    Confere email/senha no tenant do domínio. No sucesso devolve também
+    `tenant`, o domínio como cadastrado no banco central, que vai assinado no token.
+    """
+    tenant, ip = resolver_tenant(dominio)
     if not ip:
         return {"success": False, "message": "Domínio não encontrado"}
 
     conn_info = conexao(ip)
     if not conn_info["success"]:
+        # O IP em cache pode ter mudado no banco central: a próxima tentativa consulta de novo
+        invalidar_cache_tenants(dominio)
+        invalidar_cache_tenants(tenant)
         return {"success": False, "message": conn_info.get("message", "Erro na conexão")}
 
-    cursor = conn_info["connection"].cursor()
-    cursor.execute("SELECT * FROM usuarios WHERE email = %s", (email,))
-    usuario = cursor.fetchone()
+    conn = conn_info["connection"]
+    try:
+        colunas = [c for c in _COLUNAS_LOGIN if tem_coluna(conn, "usuarios", c)]
+        campos = ", ".join(colunas + ["senha"]) if colunas else "*"
+        with conn.cursor() as cursor:
+            cursor.execute(f"SELECT {campos} FROM usuarios WHERE email = %s", (email,))
+            usuario = cursor.fetchone()
+    finally:
+        conn.close()
 
     if not usuario:
         return {"success": False, "message": "Email ou senha incorretos"}
 
-    senha_hash = usuario.get("senha")
-    if not senha_hash or not verificar_senha(senha, senha_hash):
+    # A verificação roda no pool do bcrypt (model.criptografia), fora do worker da
+    # requisição; com a fila cheia o login é recusado em vez de esperar
+    senha_hash = usuario.pop("senha", None)
+    try:
+        senha_ok = bool(senha_hash) and verificar_senha(senha, senha_hash)
+    except BcryptOcupado:
+        return {"success": False, "code": "LOGIN_OCUPADO", "message": "Muitos logins no momento, tente novamente em instantes"}
+    if not senha_ok:
         return {"success": False, "message": "Email ou senha incorretos"}
 
-    # Remover hash da resposta por segurança, se presente
-    if "senha" in usuario:
-        try:
-            del usuario["senha"]
-        except Exception:
-            pass
+    # Custo do hash diferente de BCRYPT_ROUNDS: regrava em segundo plano com o custo atual
+    if precisa_rehash(senha_hash):
+        regravar_em_segundo_plano(senha, lambda novo: _regravar_hash(ip, email, senha_hash, novo))
+
+    # Login também atualiza o diretório usado pelos tokens neste processo
+    with _diretorio_lock:
+        _diretorio[tenant] = ip
+    return {"success": True, "message": "Login bem sucedido", "usuario": usuario, "tenant": tenant}
+
+
+def _regravar_hash(ip, email, hash_antigo, hash_novo):
+    # Só troca se a senha não mudou nesse meio tempo
+    with obter_conexao(ip) as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE usuarios SET senha = %s WHERE email = %s AND senha = %s",
+                (hash_novo, email, hash_antigo),
+            )
+        conn.commit()
+
+def tenant_da_requisicao():
+    """
+    Tenant da requisição autenticada ({"dominio", "host"}), colocado em `g` pelo
+    before_request a partir do token. None fora de requisição ou em rotas públicas.
+    """
+    if has_request_context():
+        return getattr(g, "tenant", None)
+    return None
 
-    return {"success": True, "message": "Login bem sucedido", "usuario": usuario}
 
 def busca_ip(dominio):
-    ip_central = "69.62.99.17"
-    conn_info = conexao(ip_central)
+    """
+    Resolve o domínio do tenant para o IP do banco, consultando o cache antes
+    do banco central. Domínios inexistentes também ficam em cache (por menos
+    tempo); falhas de acesso ao banco central não são cacheadas.
+    Em requisição autenticada vale o tenant assinado no token (ver host_do_tenant),
+    qualquer que seja o `dominio` informado.
+    """
+    tenant = tenant_da_requisicao()
+    if tenant:
+        return tenant["host"]
+    return resolver_tenant(dominio)[1]
+
+
+def resolver_tenant(dominio):
+    """
+    (domínio cadastrado em empresas_clientes, IP) para o domínio digitado, pelo
+    cache com TTL; (None, None) se não existir ou se o banco central falhar.
+    """
+    if not dominio:
+        return None, None
 
-    if conn_info["success"]:
-        conn = conn_info["connection"]
-        try:
+    agora = time.monotonic()
+    with _cache_tenants_lock:
+        item = _cache_tenants.get(dominio)
+    if item and item[2] > agora:
+        return item[1], item[0]
+
+    consultou, ip, cadastrado = _consulta_ip_central(dominio)
+    if consultou:
+        ttl = TENANT_CACHE_TTL if ip else TENANT_CACHE_NEGATIVE_TTL
+        with _cache_tenants_lock:
+            if len(_cache_tenants) >= TENANT_CACHE_MAX:
+                _cache_tenants.clear()
+            _cache_tenants[dominio] = (ip, cadastrado, agora + ttl)
+    return cadastrado, ip
+
+
+def invalidar_cache_tenants(dominio=None):
+    """
+    Remove um domínio do cache e do diretório (ou tudo, se nenhum for informado).
+    O login chama ao não conseguir conectar no host: se o IP do tenant mudou, a
+    próxima tentativa já consulta o banco central.
+    """
+    with _cache_tenants_lock:
+        if dominio is None:
+            _cache_tenants.clear()
+        else:
+            _cache_tenants.pop(dominio, None)
+    with _diretorio_lock:
+        if dominio is None:
+            _diretorio.clear()
+        else:
+            _diretorio.pop(dominio, None)
+
+
+def _carregar_diretorio():
+    """Lê empresas_clientes inteira; se o banco central falhar, fica o diretório anterior."""
+    global _diretorio
+    try:
+        with obter_conexao(IP_CENTRAL) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT dominio, ip FROM empresas_clientes WHERE dominio IS NOT NULL AND ip IS NOT NULL AND ip <> ''")
+                novo = {r["dominio"]: r["ip"] for r in cur.fetchall()}
+    except Exception as e:
+        print(f"Erro ao carregar diretório de tenants: {e}")
+        return
+    with _diretorio_lock:
+        _diretorio = novo
+
+
+def host_do_tenant(tenant):
+    """
+    Host do tenant assinado no token, resolvido no diretório em memória. A
+    primeira chamada do processo carrega o diretório inteiro; depois ele é
+    recarregado em segundo plano a cada TENANT_DIRETORIO_TTL, sem a requisição
+    esperar o banco central, e uma falha do banco central mantém o anterior.
+    Tenant fora do diretório (cadastrado depois da última carga, ou token antigo
+    com o domínio digitado) é resolvido uma vez por resolver_tenant e guardado.
+    """
+    global _diretorio_proxima
+    if not tenant:
+        return None
+    agora = time.monotonic()
+    with _diretorio_lock:
+        primeira = _diretorio_proxima is None
+        recarregar = not primeira and agora >= _diretorio_proxima
+        if primeira or recarregar:
+            _diretorio_proxima = agora + TENANT_DIRETORIO_TTL
+    if primeira:
+        _carregar_diretorio()
+    elif recarregar:
+        threading.Thread(target=_carregar_diretorio, name="diretorio-tenants", daemon=True).start()
+
+    with _diretorio_lock:
+        ip = _diretorio.get(tenant)
+    if ip:
+        return ip
+    ip = resolver_tenant(tenant)[1]
+    if ip:
+        with _diretorio_lock:
+            _diretorio[tenant] = ip
+    return ip
+
+
+def _consulta_ip_central(dominio):
+    """Retorna (consultou, ip, dominio cadastrado). consultou=False indica falha ao acessar o banco central."""
+    try:
+        with obter_conexao(IP_CENTRAL) as conn:
             with conn.cursor() as cur:
                 # 1) tentativa exata
-                cur.execute("SELECT ip FROM empresas_clientes WHERE dominio = %s", (dominio,))
+                cur.execute("SELECT dominio, ip FROM empresas_clientes WHERE dominio = %s", (dominio,))
                 row = cur.fetchone()
                 if row:
-                    return row["ip"]
+                    return True, row["ip"], row["dominio"]
 
                 # 2) se não houver ponto, tentar com .com (ex.: dualm -> dualm.com)
                 if "." not in dominio:
-                    cur.execute("SELECT ip FROM empresas_clientes WHERE dominio = %s", (f"{dominio}.com",))
+                    cur.execute("SELECT dominio, ip FROM empresas_clientes WHERE dominio = %s", (f"{dominio}.com",))
                     row = cur.fetchone()
                     if row:
-                        return row["ip"]
+                        return True, row["ip"], row["dominio"]
 
                 # 3) fallback: tentar por prefixo (caso o domínio armazenado seja subdomínio)
-                cur.execute("SELECT ip FROM empresas_clientes WHERE dominio ILIKE %s ORDER BY LENGTH(dominio) ASC LIMIT 1", (f"{dominio}%",))
+                cur.execute("SELECT dominio, ip FROM empresas_clientes WHERE dominio ILIKE %s ORDER BY LENGTH(dominio) ASC LIMIT 1", (f"{dominio}%",))
                 row = cur.fetchone()
                 if row:
-                    return row["ip"]
-                return None
-        except Exception as e:
-            print(f"Erro ao buscar IP: {e}")
-            return None
-    else:
-        return None
-
-
+                    return True, row["ip"], row["dominio"]
+                return True, None, None
+    except Exception as e:
+        print(f"Erro ao buscar IP: {e}")
+        return False, None, None
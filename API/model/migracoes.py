@@ -0,0 +1,329 @@
+"""
+Migrações versionadas dos bancos de tenant.
+
+Leva cada banco listado em empresas_clientes (banco central) ao mesmo schema
+canônico. A versão aplicada fica em schema_versao, no próprio tenant. Roda
+como etapa de release, separada da API (que sobe de qualquer jeito e recusa
+só os tenants ainda atrasados, ver tenant_em_dia). Uso:
+
+    python -m model.migracoes            # todos os tenants, em paralelo
+    python -m model.migracoes 10.0.0.5   # só os hosts informados
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from model.db_config import abrir_conexao_dedicada, obter_conexao
+from model.login import IP_CENTRAL
+from model.schema import invalidar_schema
+
+
+# Quantos tenants migrar ao mesmo tempo
+MIGRACOES_PARALELO = int(os.getenv("MIGRACOES_PARALELO", "8"))
+
+# Intervalo para reconferir a versão de um tenant atrasado (segundos)
+MIGRACOES_VERIFICACAO_TTL = int(os.getenv("MIGRACOES_VERIFICACAO_TTL", "30"))
+
+# (versão, descrição, SQL). Nunca alterar uma migração já publicada: criar a próxima.
+MIGRACOES = [
+    (1, "colunas opcionais de especialistas", """
+        ALTER TABLE especialistas ADD COLUMN IF NOT EXISTS cor text;
+        ALTER TABLE especialistas ADD COLUMN IF NOT EXISTS id_especialidade integer;
+    """),
+    (2, "nomes canônicos de cliente e especialista_convenios", """
+        DO $$
+        BEGIN
+            IF to_regclass('cliente') IS NULL AND to_regclass('clientes') IS NOT NULL THEN
+                ALTER TABLE clientes RENAME TO cliente;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns
+                            WHERE table_schema = current_schema() AND table_name = 'cliente' AND column_name = 'id_cliente')
+               AND EXISTS (SELECT 1 FROM information_schema.columns
+                            WHERE table_schema = current_schema() AND table_name = 'cliente' AND column_name = 'id') THEN
+                ALTER TABLE cliente RENAME COLUMN id TO id_cliente;
+            END IF;
+            IF to_regclass('especialista_convenios') IS NULL AND to_regclass('especialistas_convenios') IS NOT NULL THEN
+                ALTER TABLE especialistas_convenios RENAME TO especialista_convenios;
+            END IF;
+        END
+        $$;
+        CREATE TABLE IF NOT EXISTS especialista_convenios (
+            id_especialista integer NOT NULL,
+            id_convenio integer NOT NULL,
+            PRIMARY KEY (id_especialista, id_convenio)
+        );
+    """),
+    (3, "log de alterações de agendamento", """
+        CREATE TABLE IF NOT EXISTS agendamento_alteracoes (
+            id bigserial PRIMARY KEY,
+            id_agendamento integer NOT NULL,
+            operacao char(1) NOT NULL,
+            txid bigint NOT NULL DEFAULT txid_current(),
+            alterado_em timestamptz NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS agendamento_alteracoes_txid_idx ON agendamento_alteracoes (txid);
+    """),
+    (4, "índices de consulta da agenda", """
+        -- Conflito do especialista, agenda do dia e disponibilidade
+        CREATE INDEX IF NOT EXISTS agendamento_especialista_data_idx
+            ON agendamento (id_especialista, data_agendamento, horario);
+        -- Conflito do cliente e histórico do cliente
+        CREATE INDEX IF NOT EXISTS agendamento_cliente_data_idx
+            ON agendamento (id_cliente, data_agendamento);
+        -- Limite diário por convênio
+        CREATE INDEX IF NOT EXISTS agendamento_especialista_convenio_data_idx
+            ON agendamento (id_especialista, id_convenio, data_agendamento);
+        -- Ordem da listagem paginada por cursor
+        CREATE INDEX IF NOT EXISTS agendamento_listagem_idx
+            ON agendamento (data_agendamento, horario, id_agendamento);
+        CREATE INDEX IF NOT EXISTS gerencia_agenda_especialista_convenio_idx
+            ON gerencia_agenda (id_especialista, id_convenio);
+        CREATE INDEX IF NOT EXISTS especialista_especialidade_especialidade_idx
+            ON especialista_especialidade (id_especialidade);
+    """),
+    (5, "intervalo tsrange do agendamento", """
+        -- Mesma semântica do OVERLAPS: duração zero vira um ponto que colide com quem começa no mesmo instante
+        CREATE OR REPLACE FUNCTION periodo_agendamento(d date, h time, duracao integer)
+        RETURNS tsrange
+        LANGUAGE sql IMMUTABLE
+        AS $$
+            SELECT tsrange(d + h, d + h + make_interval(mins => GREATEST(COALESCE(duracao, 0), 0)),
+                           CASE WHEN COALESCE(duracao, 0) > 0 THEN '[)' ELSE '[]' END)
+        $$;
+        ALTER TABLE agendamento ADD COLUMN IF NOT EXISTS periodo tsrange
+            GENERATED ALWAYS AS (periodo_agendamento(data_agendamento::date, horario, duracao)) STORED;
+        -- Com btree_gist o índice cobre (especialista/cliente, período); sem a extensão, só o período
+        DO $$
+        BEGIN
+            BEGIN
+                CREATE EXTENSION IF NOT EXISTS btree_gist;
+            EXCEPTION WHEN OTHERS THEN
+                RAISE NOTICE 'btree_gist indisponível: %', SQLERRM;
+            END;
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'btree_gist') THEN
+                CREATE INDEX IF NOT EXISTS agendamento_especialista_periodo_idx
+                    ON agendamento USING gist (id_especialista, periodo);
+                CREATE INDEX IF NOT EXISTS agendamento_cliente_periodo_idx
+                    ON agendamento USING gist (id_cliente, periodo);
+            ELSE
+                CREATE INDEX IF NOT EXISTS agendamento_periodo_idx
+                    ON agendamento USING gist (periodo);
+            END IF;
+        END
+        $$;
+    """),
+    (6, "contador diário de agendamentos por convênio", """
+        -- Bloqueia gravações na agenda até o commit: a carga inicial não perde agendamentos concorrentes
+        LOCK TABLE agendamento IN SHARE ROW EXCLUSIVE MODE;
+        CREATE TABLE IF NOT EXISTS agenda_convenio_dia (
+            id_especialista integer NOT NULL,
+            id_convenio integer NOT NULL,
+            data_agendamento date NOT NULL,
+            total integer NOT NULL DEFAULT 0,
+            PRIMARY KEY (id_especialista, id_convenio, data_agendamento)
+        );
+        CREATE OR REPLACE FUNCTION agenda_convenio_dia_contar()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE')
+               AND OLD.id_especialista IS NOT NULL AND OLD.id_convenio IS NOT NULL AND OLD.data_agendamento IS NOT NULL THEN
+                UPDATE agenda_convenio_dia
+                   SET total = total - 1
+                 WHERE id_especialista = OLD.id_especialista
+                   AND id_convenio = OLD.id_convenio
+                   AND data_agendamento = OLD.data_agendamento::date;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE')
+               AND NEW.id_especialista IS NOT NULL AND NEW.id_convenio IS NOT NULL AND NEW.data_agendamento IS NOT NULL THEN
+                INSERT INTO agenda_convenio_dia (id_especialista, id_convenio, data_agendamento, total)
+                VALUES (NEW.id_especialista, NEW.id_convenio, NEW.data_agendamento::date, 1)
+                ON CONFLICT (id_especialista, id_convenio, data_agendamento)
+                DO UPDATE SET total = agenda_convenio_dia.total + 1;
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        DROP TRIGGER IF EXISTS agendamento_convenio_dia ON agendamento;
+        CREATE TRIGGER agendamento_convenio_dia
+            AFTER INSERT OR DELETE OR UPDATE OF id_especialista, id_convenio, data_agendamento ON agendamento
+            FOR EACH ROW EXECUTE FUNCTION agenda_convenio_dia_contar();
+        INSERT INTO agenda_convenio_dia (id_especialista, id_convenio, data_agendamento, total)
+        SELECT id_especialista, id_convenio, data_agendamento::date, COUNT(*)
+        FROM agendamento
+        WHERE id_especialista IS NOT NULL AND id_convenio IS NOT NULL AND data_agendamento IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (id_especialista, id_convenio, data_agendamento)
+        DO UPDATE SET total = EXCLUDED.total;
+    """),
+    (7, "log de alterações gravado por trigger", """
+        -- Hora da gravação (não do início da transação): é com ela que a janela de reenvio é medida
+        ALTER TABLE agendamento_alteracoes ALTER COLUMN alterado_em SET DEFAULT clock_timestamp();
+        -- O cursor passou a ser o id; alterado_em serve à janela e à limpeza por retenção
+        DROP INDEX IF EXISTS agendamento_alteracoes_txid_idx;
+        CREATE INDEX IF NOT EXISTS agendamento_alteracoes_alterado_em_idx ON agendamento_alteracoes (alterado_em);
+        CREATE OR REPLACE FUNCTION agendamento_alteracoes_registrar()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO agendamento_alteracoes (id_agendamento, operacao) VALUES (OLD.id_agendamento, 'D');
+            ELSE
+                INSERT INTO agendamento_alteracoes (id_agendamento, operacao) VALUES (NEW.id_agendamento, left(TG_OP, 1));
+            END IF;
+            RETURN NULL;
+        END
+        $$;
+        DROP TRIGGER IF EXISTS agendamento_registrar_alteracao ON agendamento;
+        CREATE TRIGGER agendamento_registrar_alteracao
+            AFTER INSERT OR UPDATE OR DELETE ON agendamento
+            FOR EACH ROW EXECUTE FUNCTION agendamento_alteracoes_registrar();
+    """),
+    (8, "NOTIFY das alterações de agendamento para o serviço de eventos", """
+        CREATE OR REPLACE FUNCTION agendamento_alteracoes_registrar()
+        RETURNS trigger
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE
+            v_id integer;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                v_id := OLD.id_agendamento;
+            ELSE
+                v_id := NEW.id_agendamento;
+            END IF;
+            INSERT INTO agendamento_alteracoes (id_agendamento, operacao) VALUES (v_id, left(TG_OP, 1));
+            -- Entregue só no commit: rollback não gera evento (ver model.eventos_agenda)
+            PERFORM pg_notify('agenda_alteracoes',
+                              json_build_object('id_agendamento', v_id, 'operacao', lower(TG_OP))::text);
+            RETURN NULL;
+        END
+        $$;
+    """),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+# host -> expiração (monotonic) da última leitura que achou o tenant atrasado.
+# Tenant em dia entra com expiração infinita: a versão não volta atrás
+_verificacoes = {}
+_verificacoes_lock = threading.Lock()
+
+
+def listar_tenants():
+    """Hosts distintos dos bancos de tenant cadastrados no banco central."""
+    with obter_conexao(IP_CENTRAL) as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT DISTINCT ip FROM empresas_clientes WHERE ip IS NOT NULL AND ip <> '' ORDER BY ip")
+            return [r["ip"] for r in cur.fetchall()]
+
+
+def migrar_tenant(host):
+    """
+    Aplica, em ordem, as migrações que faltam no banco do host (uma transação
+    por migração). Um advisory lock de sessão impede duas execuções simultâneas
+    no mesmo banco (ex.: dois containers subindo juntos).
+    """
+    aplicadas = []
+    try:
+        conn = abrir_conexao_dedicada(host)
+    except Exception as e:
+        return {"host": host, "success": False, "aplicadas": aplicadas, "message": f"Erro na conexão: {e}"}
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(hashtext('dualm:migracoes'))")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_versao (
+                versao integer PRIMARY KEY,
+                descricao text NOT NULL,
+                aplicada_em timestamptz NOT NULL DEFAULT now()
+            )
+        """)
+        conn.commit()
+        cur.execute("SELECT versao FROM schema_versao")
+        feitas = {r["versao"] for r in cur.fetchall()}
+        for versao, descricao, sql in MIGRACOES:
+            if versao in feitas:
+                continue
+            cur.execute(sql)
+            cur.execute("INSERT INTO schema_versao (versao, descricao) VALUES (%s, %s)", (versao, descricao))
+            conn.commit()
+            aplicadas.append(versao)
+        return {"host": host, "success": True, "aplicadas": aplicadas, "versao": VERSAO_ATUAL}
+    except Exception as e:
+        conn.rollback()
+        return {"host": host, "success": False, "aplicadas": aplicadas, "message": f"Erro ao migrar: {e}"}
+    finally:
+        try:
+            # Encerrar a sessão também libera o advisory lock
+            conn.close()
+        except Exception:
+            pass
+        if aplicadas:
+            invalidar_schema(host)
+
+
+def _versao_aplicada(host):
+    with obter_conexao(host) as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute("SELECT max(versao) AS versao FROM schema_versao")
+            except psycopg2.errors.UndefinedTable:
+                return 0
+            return (cur.fetchone() or {}).get("versao") or 0
+
+
+def tenant_em_dia(host):
+    """
+    Se o banco do host já está em VERSAO_ATUAL. Um tenant atrasado é logado e
+    reconferido a cada MIGRACOES_VERIFICACAO_TTL; os demais seguem atendidos.
+    Falha de conexão conta como em dia: o erro aparece na própria requisição.
+    """
+    if not host:
+        return True
+    agora = time.monotonic()
+    with _verificacoes_lock:
+        expira = _verificacoes.get(host)
+    if expira is not None and expira > agora:
+        return expira == float("inf")
+
+    try:
+        versao = _versao_aplicada(host)
+    except psycopg2.Error as e:
+        print(f"Erro ao conferir a versão do schema em '{host}': {e}")
+        return True
+    em_dia = versao >= VERSAO_ATUAL
+    if not em_dia:
+        print(f"Tenant '{host}' na versão {versao} do schema (esperada {VERSAO_ATUAL}): "
+              f"requisições recusadas até rodar python -m model.migracoes")
+    with _verificacoes_lock:
+        _verificacoes[host] = float("inf") if em_dia else agora + MIGRACOES_VERIFICACAO_TTL
+    return em_dia
+
+
+def migrar_todos(hosts=None, paralelo=MIGRACOES_PARALELO):
+    """Migra os hosts informados (ou todos os tenants) em paralelo. Retorna a lista de resultados."""
+    if hosts is None:
+        hosts = listar_tenants()
+    if not hosts:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(paralelo, len(hosts)))) as executor:
+        return list(executor.map(migrar_tenant, hosts))
+
+
+if __name__ == "__main__":
+    resultados = migrar_todos(sys.argv[1:] or None)
+    falhas = 0
+    for r in resultados:
+        if r["success"]:
+            print(f"{r['host']}: versão {r['versao']} (aplicadas: {r['aplicadas'] or 'nenhuma'})")
+        else:
+            falhas += 1
+            print(f"{r['host']}: FALHOU após {r['aplicadas'] or 'nenhuma'} - {r['message']}")
+    sys.exit(1 if falhas else 0)
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+
+# Por quanto tempo o mapa de tabelas/colunas de um tenant vale sem nova leitura (segundos)
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", "600"))
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CapacidadesSchema:
+    """Tabelas e colunas existentes no banco de um tenant, lidas de uma vez só."""
+
+    __slots__ = ("colunas",)
+
+    def __init__(self, colunas):
+        # {tabela: frozenset(colunas)}
+        self.colunas = colunas
+
+    def tem_tabela(self, tabela):
+        return tabela in self.colunas
+
+    def tem_coluna(self, tabela, coluna):
+        return coluna in self.colunas.get(tabela, ())
+
+
+def _carregar(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT table_name, column_name
+            FROM information_schema.columns
+            WHERE table_schema NOT IN ('pg_catalog', 'information_schema')
+            """
+        )
+        rows = cur.fetchall()
+    colunas = {}
+    for r in rows:
+        colunas.setdefault(r["table_name"], set()).add(r["column_name"])
+    return CapacidadesSchema({t: frozenset(c) for t, c in colunas.items()})
+
+
+def capacidades(conn):
+    """
+    Mapa de capacidades do tenant da conexão. Lido numa única consulta ao
+    information_schema e mantido em cache por host durante SCHEMA_CACHE_TTL.
+    """
+    host = getattr(conn, "host", None)
+    agora = time.monotonic()
+    with _cache_lock:
+        item = _cache.get(host)
+    if item and item[1] > agora:
+        return item[0]
+
+    caps = _carregar(conn)
+    if host is not None:
+        with _cache_lock:
+            _cache[host] = (caps, agora + SCHEMA_CACHE_TTL)
+    return caps
+
+
+def tem_tabela(conn, tabela):
+    try:
+        return capacidades(conn).tem_tabela(tabela)
+    except Exception:
+        return False
+
+
+def tem_coluna(conn, tabela, coluna):
+    try:
+        return capacidades(conn).tem_coluna(tabela, coluna)
+    except Exception:
+        return False
+
+
+# Nomes reais de tabelas/colunas que variam entre bancos de tenants mais antigos
+Dialeto = namedtuple("Dialeto", ["tabela_cliente", "id_cliente", "tabela_especialista_convenios"])
+
+
+def _primeira_existente(caps, tabelas):
+    for t in tabelas:
+        if caps.tem_tabela(t):
+            return t
+    return tabelas[0]
+
+
+def dialeto(conn):
+    """
+    Resolve, a partir do mapa em cache, os nomes que os models devem usar no
+    tenant (cliente/clientes, id_cliente/id, especialista_convenios/especialistas_convenios).
+    Sem o mapa, assume os nomes atuais.
+    """
+    try:
+        caps = capacidades(conn)
+    except Exception:
+        return Dialeto("cliente", "id_cliente", "especialista_convenios")
+    tabela_cliente = _primeira_existente(caps, ("cliente", "clientes"))
+    id_cliente = "id" if (caps.tem_coluna(tabela_cliente, "id") and not caps.tem_coluna(tabela_cliente, "id_cliente")) else "id_cliente"
+    return Dialeto(
+        tabela_cliente,
+        id_cliente,
+        _primeira_existente(caps, ("especialista_convenios", "especialistas_convenios")),
+    )
+
+
+def invalidar_schema(host=None):
+    """Descarta o mapa de um tenant (ou de todos). Usar após alterar a estrutura do banco."""
+    with _cache_lock:
+        if host is None:
+            _cache.clear()
+        else:
+            _cache.pop(host, None)
@@ -1,42 +1,9 @@
 from model.db_config import conexao
 from model.login import busca_ip
+from model.schema import tem_coluna, tem_tabela
 from model.criptografia import camuflar_senha
 
 
-def _has_column(conn, table_name, column_name):
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1
-                FROM information_schema.columns
-                WHERE table_name = %s AND column_name = %s
-                LIMIT 1
-                """,
-                (table_name, column_name),
-            )
-            return cur.fetchone() is not None
-    except Exception:
-        return False
-
-
-def _has_table(conn, table_name):
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT 1
-                FROM information_schema.tables
-                WHERE table_name = %s
-                LIMIT 1
-                """,
-                (table_name,),
-            )
-            return cur.fetchone() is not None
-    except Exception:
-        return False
-
-
 def listar(dominio):
     if not dominio:
         return {"success": False, "message": "Parâmetro 'dominio' é obrigatório"}
@@ -51,9 +18,9 @@ def listar(dominio):
 
     conn = conn_info["connection"]
     try:
-        usuarios_has_nivel = _has_column(conn, 'usuarios', 'nivel')
-        usuarios_has_id_nivel = _has_column(conn, 'usuarios', 'id_nivel')
-        nivel_table_exists = _has_table(conn, 'nivel_usuario')
+        usuarios_has_nivel = tem_coluna(conn, 'usuarios', 'nivel')
+        usuarios_has_id_nivel = tem_coluna(conn, 'usuarios', 'id_nivel')
+        nivel_table_exists = tem_tabela(conn, 'nivel_usuario')
         with conn.cursor() as cur:
             if usuarios_has_id_nivel and nivel_table_exists:
                 # Temos FK e tabela de níveis: podemos realizar o JOIN e retornar nome do nível
@@ -144,16 +111,16 @@ def criar(dominio, nome_usuario, email, senha, nivel='usuario', id_especialista=
     conn = conn_info["connection"]
     try:
         senha_hash = camuflar_senha(senha)
-        nivel_exists = _has_column(conn, 'usuarios', 'id_nivel') or _has_column(conn, 'usuarios', 'nivel')
+        nivel_exists = tem_coluna(conn, 'usuarios', 'id_nivel') or tem_coluna(conn, 'usuarios', 'nivel')
         with conn.cursor() as cur:
             if nivel_exists:
-                if _has_column(conn, 'usuarios', 'id_nivel'):
+                if tem_coluna(conn, 'usuarios', 'id_nivel'):
                     # quando existe id_nivel, nivel recebido pode ser id inteiro ou nome; tentamos como id
                     try:
                         id_nivel = int(nivel) if nivel is not None else None
                     except Exception:
                         id_nivel = None
-                    if _has_column(conn, 'usuarios', 'id_especialista'):
+                    if tem_coluna(conn, 'usuarios', 'id_especialista'):
                         cur.execute(
                             """
                             INSERT INTO usuarios (nome_usuario, email, senha, id_nivel, id_especialista)
@@ -172,7 +139,7 @@ def criar(dominio, nome_usuario, email, senha, nivel='usuario', id_especialista=
                             (nome_usuario, email, senha_hash, id_nivel)
                         )
                 else:
-                    if _has_column(conn, 'usuarios', 'id_especialista'):
+                    if tem_coluna(conn, 'usuarios', 'id_especialista'):
                         cur.execute(
                             """
                             INSERT INTO usuarios (nome_usuario, email, senha, nivel, id_especialista)
@@ -191,7 +158,7 @@ def criar(dominio, nome_usuario, email, senha, nivel='usuario', id_especialista=
                             (nome_usuario, email, senha_hash, nivel)
                         )
             else:
-                if _has_column(conn, 'usuarios', 'id_especialista'):
+                if tem_coluna(conn, 'usuarios', 'id_especialista'):
                     cur.execute(
                         """
                         INSERT INTO usuarios (nome_usuario, email, senha, id_especialista)
@@ -253,9 +220,9 @@ def atualizar(dominio, id_usuario, nome_usuario=None, email=None, senha=None, ni
             campos.append("senha = %s")
             valores.append(camuflar_senha(senha))
 
-        nivel_exists = _has_column(conn, 'usuarios', 'id_nivel') or _has_column(conn, 'usuarios', 'nivel')
+        nivel_exists = tem_coluna(conn, 'usuarios', 'id_nivel') or tem_coluna(conn, 'usuarios', 'nivel')
         if nivel_exists and (nivel is not None):
-            if _has_column(conn, 'usuarios', 'id_nivel'):
+            if tem_coluna(conn, 'usuarios', 'id_nivel'):
                 campos.append("id_nivel = %s")
                 try:
                     valores.append(int(nivel))
@@ -265,7 +232,7 @@ def atualizar(dominio, id_usuario, nome_usuario=None, email=None, senha=None, ni
                 campos.append("nivel = %s")
                 valores.append(nivel)
 
-        if _has_column(conn, 'usuarios', 'id_especialista') and (id_especialista is not None):
+        if tem_coluna(conn, 'usuarios', 'id_especialista') and (id_especialista is not None):
             campos.append("id_especialista = %s")
             try:
                 valores.append(int(id_especialista) if id_especialista is not None else None)
@@ -277,7 +244,7 @@ def atualizar(dominio, id_usuario, nome_usuario=None, email=None, senha=None, ni
 
         valores.append(id_usuario)
         if nivel_exists:
-            if _has_column(conn, 'usuarios', 'id_nivel'):
+            if tem_coluna(conn, 'usuarios', 'id_nivel'):
                 query = f"UPDATE usuarios SET {', '.join(campos)} WHERE id_usuario = %s RETURNING id_usuario, nome_usuario, email, id_nivel"
             else:
                 query = f"UPDATE usuarios SET {', '.join(campos)} WHERE id_usuario = %s RETURNING id_usuario, nome_usuario, email, COALESCE(nivel, 'usuario') AS nivel"
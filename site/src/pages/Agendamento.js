@@ -192,14 +192,39 @@ const Agendamento = () => {
   const [confirmDelete, setConfirmDelete] = useState({ open: false, loading: false, error: '' });
   const [confirmOverride, setConfirmOverride] = useState({ open: false, loading: false, message: '', limite: null, qtd_atual: null, payload: null });
 
+  // Período carregado do servidor: o mês de `current` mais a semana que o contém
+  // (a visão semanal pode atravessar a virada do mês)
+  const periodo = useMemo(() => {
+    const iso = (d) => `${d.getFullYear()}-${String(d.getMonth() + 1).padStart(2, '0')}-${String(d.getDate()).padStart(2, '0')}`;
+    const inicioSemana = new Date(current.getFullYear(), current.getMonth(), current.getDate() - ((current.getDay() + 6) % 7));
+    const fimSemana = new Date(inicioSemana.getFullYear(), inicioSemana.getMonth(), inicioSemana.getDate() + 6);
+    const inicioMes = new Date(current.getFullYear(), current.getMonth(), 1);
+    const fimMes = new Date(current.getFullYear(), current.getMonth() + 1, 0);
+    return {
+      de: iso(inicioSemana < inicioMes ? inicioSemana : inicioMes),
+      ate: iso(fimSemana > fimMes ? fimSemana : fimMes),
+    };
+  }, [current]);
+
+  // A listagem é paginada no servidor: segue o proximo_cursor até cobrir o período
+  const buscarAgendamentos = async (dominio) => {
+    const todos = [];
+    let cursor;
+    do {
+      const res = await axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio, de: periodo.de, ate: periodo.ate, limite: 500, cursor } });
+      const data = res.data || {};
+      if (Array.isArray(data.agendamentos)) todos.push(...data.agendamentos);
+      cursor = data.proximo_cursor || undefined;
+    } while (cursor);
+    return todos;
+  };
+
   useEffect(() => {
     const load = async () => {
       setLoading(true);
       try {
         const dominio = authService.getCurrentClient()?.dominio;
-        const res = await axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio } });
-        const data = res.data || {};
-        setItems(Array.isArray(data.agendamentos) ? data.agendamentos : []);
+        setItems(await buscarAgendamentos(dominio));
         try {
           const esp = await especialistasService.list();
           setEspecialistas(Array.isArray(esp) ? esp : []);
@@ -215,7 +240,86 @@ const Agendamento = () => {
       }
     };
     load();
-  }, [current]);
+  }, [periodo]);
+
+  // Atualização da agenda: busca só o que mudou desde a última consulta (/agendamentos/changes),
+  // a cada evento do serviço SSE e, sem conexão de eventos aberta, a cada 15s
+  useEffect(() => {
+    const dominio = authService.getCurrentClient()?.dominio;
+    if (!dominio) return undefined;
+    let cursor = null;
+    let ativo = true;
+    let emAndamento = false;
+    const sincronizar = async () => {
+      if (emAndamento || document.hidden) return;
+      emAndamento = true;
+      try {
+        const res = await axios.get(`${API_BASE_URL}/agendamentos/changes`, { params: { dominio, since: cursor || undefined } });
+        const data = res.data || {};
+        if (!ativo || !data.success) return;
+        const primeira = cursor === null;
+        const alteracoes = Array.isArray(data.alteracoes) ? data.alteracoes : [];
+        cursor = data.cursor;
+        if (primeira || !alteracoes.length) return;
+        setItems(prev => {
+          const porId = new Map(prev.map(i => [i.id_agendamento, i]));
+          alteracoes.forEach(a => {
+            const dia = (a.agendamento?.data_agendamento || '').slice(0, 10);
+            // Fora do período carregado: só remove, se estiver na lista
+            if (a.operacao === 'delete' || dia < periodo.de || dia > periodo.ate) porId.delete(a.id_agendamento);
+            else porId.set(a.id_agendamento, a.agendamento);
+          });
+          return Array.from(porId.values()).sort((a, b) =>
+            `${a.data_agendamento} ${a.horario}`.localeCompare(`${b.data_agendamento} ${b.horario}`));
+        });
+      } catch (_) {
+      } finally {
+        emAndamento = false;
+      }
+    };
+    // Cada conexão usa um ticket de uso único pedido à API: o EventSource não
+    // envia o token, e a reconexão automática dele reusaria um ticket gasto
+    let fonte = null;
+    let religar = null;
+    let tentativas = 0;
+    const reconectar = () => {
+      tentativas += 1;
+      religar = setTimeout(conectar, Math.min(30000, 1000 * 2 ** tentativas));
+    };
+    const conectar = async () => {
+      if (!ativo) return;
+      try {
+        const res = await axios.post(`${API_BASE_URL}/agendamentos/eventos/ticket`, { dominio });
+        const { ticket, url } = res.data || {};
+        if (!ativo || !ticket || !url) return;
+        fonte = new EventSource(`${url}?ticket=${encodeURIComponent(ticket)}`);
+        fonte.onopen = () => { tentativas = 0; sincronizar(); };
+        fonte.addEventListener('agenda', sincronizar);
+        fonte.onerror = () => {
+          fonte.close();
+          fonte = null;
+          if (ativo) reconectar();
+        };
+      } catch (e) {
+        // 404: serviço de eventos desativado, fica só a consulta periódica
+        if (ativo && e.response?.status !== 404) reconectar();
+      }
+    };
+    sincronizar();
+    conectar();
+    const intervalo = setInterval(() => {
+      if (!fonte || fonte.readyState !== EventSource.OPEN) sincronizar();
+    }, 15000);
+    // Ao voltar para a aba, não espera o próximo intervalo (eventos com a aba oculta são ignorados)
+    document.addEventListener('visibilitychange', sincronizar);
+    return () => {
+      ativo = false;
+      clearInterval(intervalo);
+      clearTimeout(religar);
+      if (fonte) fonte.close();
+      document.removeEventListener('visibilitychange', sincronizar);
+    };
+  }, [periodo]);
 
   const days = useMemo(() => {
     const year = current.getFullYear();
@@ -508,9 +612,7 @@ const Agendamento = () => {
                       await axios.post(`${API_BASE_URL}/agendamentos`, payload);
                     }
                     // reload
-                    const res = await axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio } });
-                    const data = res.data || {};
-                    setItems(Array.isArray(data.agendamentos) ? data.agendamentos : []);
+                    setItems(await buscarAgendamentos(dominio));
                     setCreateOpen(false);
                     setEditingAgId(null);
                   } catch (err) {
@@ -577,9 +679,7 @@ const Agendamento = () => {
                 try {
                   const dominio = authService.getCurrentClient()?.dominio;
                   await axios.delete(`${API_BASE_URL}/agendamentos/${editingAgId}`, { params: { dominio } });
-                  const res = await axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio } });
-                  const data = res.data || {};
-                  setItems(Array.isArray(data.agendamentos) ? data.agendamentos : []);
+                  setItems(await buscarAgendamentos(dominio));
                   setConfirmDelete({ open: false, loading: false, error: '' });
                   setCreateOpen(false);
                   setEditingAgId(null);
@@ -612,9 +712,7 @@ const Agendamento = () => {
                   const payload = { ...confirmOverride.payload, ignorar_limite: true };
                   await axios.post(`${API_BASE_URL}/agendamentos`, payload);
                   const dominio = authService.getCurrentClient()?.dominio;
-                  const res = await axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio } });
-                  const data = res.data || {};
-                  setItems(Array.isArray(data.agendamentos) ? data.agendamentos : []);
+                  setItems(await buscarAgendamentos(dominio));
                   setConfirmOverride({ open: false, loading: false, message: '', limite: null, qtd_atual: null, payload: null });
                   setCreateOpen(false);
                   setEditingAgId(null);
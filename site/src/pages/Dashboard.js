@@ -129,7 +129,7 @@ const Dashboard = () => {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
   const [agendamentos, setAgendamentos] = useState([]);
-  const [stats, setStats] = useState({ hoje: 0, semana: 0, mes: 0, futuros: 0, porMedico: [] });
+  const [stats, setStats] = useState({ hoje: 0, semana: 0, mes: 0, futuros: 0 });
   const API_BASE_URL = process.env.REACT_APP_API_URL || axios.defaults.baseURL || 'http://localhost:5000';
 
   useEffect(() => {
@@ -138,40 +138,17 @@ const Dashboard = () => {
       setError('');
       try {
         const dominio = authService.getCurrentClient()?.dominio;
-        const res = await axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio } });
-        const data = res.data || {};
-        const items = Array.isArray(data.agendamentos) ? data.agendamentos : [];
-        setAgendamentos(items);
-        // calcular stats
-        const todayKey = new Date().toISOString().slice(0,10);
+        // Data e hora locais: as contagens e a lista partem do "hoje" de quem está usando
         const agora = new Date();
-        const firstDayOfWeek = new Date(agora);
-        firstDayOfWeek.setDate(agora.getDate() - ((agora.getDay() + 6) % 7));
-        const lastDayOfWeek = new Date(firstDayOfWeek);
-        lastDayOfWeek.setDate(firstDayOfWeek.getDate() + 6);
-        const firstDayOfMonth = new Date(agora.getFullYear(), agora.getMonth(), 1);
-        const lastDayOfMonth = new Date(agora.getFullYear(), agora.getMonth() + 1, 0);
-        const inRange = (d, a, b) => {
-          const dt = new Date(d);
-          return dt >= a && dt <= b;
-        };
-        const sHoje = items.filter(i => (i.data_agendamento || '').slice(0,10) === todayKey).length;
-        const sSemana = items.filter(i => inRange((i.data_agendamento || '').slice(0,10), firstDayOfWeek, lastDayOfWeek)).length;
-        const sMes = items.filter(i => inRange((i.data_agendamento || '').slice(0,10), firstDayOfMonth, lastDayOfMonth)).length;
-        const sFuturos = items.filter(i => {
-          const dateStr = (i.data_agendamento || '').slice(0,10);
-          if (!dateStr) return false;
-          const timeStr = (i.horario || '00:00').toString().slice(0,5);
-          const dt = new Date(`${dateStr}T${timeStr}:00`);
-          return dt >= agora;
-        }).length;
-        const porMed = Object.values(items.reduce((acc, it) => {
-          const key = it.id_especialista;
-          if (!acc[key]) acc[key] = { nome: it.nome_especialista || 'Médico', total: 0 };
-          acc[key].total += 1;
-          return acc;
-        }, {}));
-        setStats({ hoje: sHoje, semana: sSemana, mes: sMes, futuros: sFuturos, porMedico: porMed.sort((a,b) => b.total - a.total).slice(0,5) });
+        const hoje = `${agora.getFullYear()}-${String(agora.getMonth() + 1).padStart(2, '0')}-${String(agora.getDate()).padStart(2, '0')}`;
+        const hora = `${String(agora.getHours()).padStart(2, '0')}:${String(agora.getMinutes()).padStart(2, '0')}`;
+        const [lista, resumo] = await Promise.all([
+          axios.get(`${API_BASE_URL}/agendamentos`, { params: { dominio, de: hoje, limite: 8 } }),
+          axios.get(`${API_BASE_URL}/agendamentos/resumo`, { params: { dominio, hoje, agora: hora } }),
+        ]);
+        const items = Array.isArray(lista.data?.agendamentos) ? lista.data.agendamentos : [];
+        setAgendamentos(items);
+        setStats({ hoje: 0, semana: 0, mes: 0, futuros: 0, ...(resumo.data?.resumo || {}) });
       } catch (e) {
         setError(e.message || 'Erro ao carregar');
       } finally {
@@ -215,7 +192,7 @@ const Dashboard = () => {
         <SectionTitle>Próximos agendamentos</SectionTitle>
         {loading ? 'Carregando...' : error ? (<div style={{ color: '#b91c1c' }}>{error}</div>) : (
           <ActivityList>
-            {agendamentos.slice(0,8).map(a => (
+            {agendamentos.map(a => (
               <ActivityItem key={a.id_agendamento}>
                 <ActivityIcon>🗓️</ActivityIcon>
                 <ActivityContent>